@@ -0,0 +1,297 @@
+"""
+Compile an object graph (SpikingNeuron, Pulsar, PoissonSpiker, Synapse, ... wired with connect / add_target /
+add_spike_listener) into array populations and sparse projections.
+
+    sim = Compiler.compile_simulation(1.0 / 1200.0, entities)
+    sim.run_until(500.0)
+
+Homogeneous entities are grouped into populations, synapses between them into projections (Stdp and
+DopamineStdp synapses into plastic projections, with one trace per neuron), and anything
+the compiler doesn't recognize is kept as an ordinary object entity, rewired to talk to the populations
+through NeuronViews.  The result is an SnnBase.Simulation, with its strict prepare / step / exchange phases.
+
+NB: after compiling, compiled neurons' state lives in the populations, not in the original objects.
+Use view_for(entity) to read it.
+
+PoissonSpikers drawing from the random module are compiled into a population with generators of its own
+(seeded from random), so they give different spike trains with the same statistics.  PoissonSpikers with
+an rng of their own (a RandomStreams stream, say) are left as objects, so their spike trains stay exactly
+reproducible.
+"""
+
+import random
+
+import numpy as np
+
+import SnnBase
+import Stdp
+import DopamineStdp
+import Populations
+import Projections
+
+
+class CompiledSimulation(SnnBase.Simulation):
+    def __init__(self, step, populations, projections, fallback, views):
+        super().__init__(step)
+
+        self.populations = populations
+        self.projections = projections
+        self.fallback = fallback
+
+        self._views = views
+
+        self.add_entities(populations)
+        self.add_entities(projections)
+        self.add_entities(fallback)
+
+    def view_for(self, entity):
+        """the NeuronView now standing in for a compiled entity
+        """
+        return self._views[entity]
+
+
+def _is_idle(syn):
+    """true if a synapse has no spikes in flight, so it can be replaced without losing any
+    """
+    return syn._line.in_flight() == 0
+
+def _plastic_key(syn, managers):
+    """what a plastic synapse's projection has to share with it: type, parameters, freeze state and reward managers.
+    None if it can't be compiled: pending changes, or wired up some other way than connect does.
+    """
+    if len(syn.targets) != 1 or syn not in syn.targets[0].spike_listeners:
+        return None
+
+    if type(syn) is Stdp.StdpSynapse:
+        if syn.efficiency_update != 0.0:
+            return None
+
+        return (Projections.StdpProjection, syn.clock, syn.frozen, syn.plasticity_switch,
+                syn.A_p, syn.tau_p, syn.A_m, syn.tau_m)
+
+    params = (Projections.DopamineStdpProjection, syn.clock, syn.frozen, syn.plasticity_switch, syn.A_p, syn.tau_p, syn.A_m, syn.tau_m, syn.tau_c, syn.r,
+              syn.reward_source, syn.reward_signal)
+
+    return params + tuple(rm for rm in managers if syn in rm.rewardables)
+
+def _connect_plastic(key, src_pop, tgt_pop, syns, src_i, tgt_i):
+    cls, clock, frozen, switch, A_p, tau_p, A_m, tau_m = key[:8]
+    lazy = clock is not None
+
+    # decay held while frozen is made up now, the projection holds its own from here on
+    for s in syns:
+        if s._held is not None:
+            s._thaw()
+
+    eff = np.array([s.efficiency for s in syns])
+    delay = np.array([s.delay for s in syns])
+    lo = np.array([s.min_efficiency for s in syns])
+    hi = np.array([s.max_efficiency for s in syns])
+
+    if cls is Projections.StdpProjection:
+        proj = cls.connect_pairs(src_pop, tgt_pop, src_i, tgt_i, eff, delay, lo, hi,
+                                 A_p=A_p, tau_p=tau_p, A_m=A_m, tau_m=tau_m, lazy_traces=lazy)
+    else:
+        tau_c, r, reward_source, reward_signal = key[8:12]
+
+        if reward_source is not None:
+            for s in syns:
+                s.settle(clock.time)
+
+            eff = np.array([s.efficiency for s in syns])
+
+        proj = cls.connect_pairs(src_pop, tgt_pop, src_i, tgt_i, eff, delay, lo, hi,
+                                 A_p=A_p, tau_p=tau_p, A_m=A_m, tau_m=tau_m, tau_c=tau_c, lazy_traces=lazy,
+                                 event_driven=reward_source is not None, reward_manager=reward_source,
+                                 reward_signal=reward_signal)
+        proj.r[0] = r
+
+        _, _, order = Projections.pairs_to_csr(len(src_pop), src_i, tgt_i)
+        proj.c[0] = np.array([s.c for s in syns])[order]
+        proj._refresh_active()
+
+        if reward_source is not None:
+            reward_source.event_rewardables = [x for x in reward_source.event_rewardables if x not in syns]
+            proj._c_time.fill(clock.time)
+
+        for rm in key[12:]:
+            rm.rewardables = [x for x in rm.rewardables if x not in syns]
+            rm.add_rewardable(proj)
+
+    proj.frozen = frozen
+    if switch is not None:
+        compiled = set(syns)
+        switch.members = [m for m in switch.members if m not in compiled]
+        switch.add(proj)
+
+    if lazy:
+        for s in syns:
+            s._catch_up()
+
+        proj._time = clock.time
+        proj._P_time.fill(clock.time)
+        proj._M_time.fill(clock.time)
+
+    # the traces are the same on every synapse from a source (or onto a target)
+    for s, i, j in zip(syns, src_i, tgt_i):
+        proj.P[0, i] = s.P
+        proj.M[0, j] = s.M
+
+    return proj
+
+def _compile_neurons(neurons):
+    """one LifPopulation per distinct set of currents
+    """
+    groups = {}
+    for n in neurons:
+        groups.setdefault(tuple(id(c) for c in n.currents), []).append(n)
+
+    result = []
+
+    for members in groups.values():
+        pop = Populations.LifPopulation(len(members),
+                                        [n.threshold for n in members],
+                                        [n.magnitude for n in members],
+                                        [n.eql for n in members],
+                                        [n.tau for n in members])
+
+        for current in members[0].currents:
+            pop.add_current(current)
+
+        for i, n in enumerate(members):
+            pop.charge[0, i] = n.charge
+            pop.input[0, i] = sum(n.received_spikes)
+            pop.spiked[0, i] = n.spike
+
+        result.append((pop, members))
+
+    return result
+
+def _compile_pulsars(pulsars):
+    pop = Populations.PulsarPopulation([p.magnitude for p in pulsars], [p.frequency for p in pulsars])
+
+    for i, p in enumerate(pulsars):
+        pop.delay[i] = p.delay
+        pop.remaining[0, i] = p.remaining
+        pop.spiked[0, i] = p._spike
+
+    return pop, pulsars
+
+def _compile_poisson(spikers):
+    """NB: the population draws from its own generators, so compiled runs see different spike trains
+    (with the same statistics) than the objects would.  Only spikers on the random module get here.
+    """
+    pop = Populations.PoissonPopulation([p.magnitude for p in spikers], [p.frequency for p in spikers])
+
+    for i, p in enumerate(spikers):
+        pop.spiked[0, i] = p._spike
+
+    return pop, spikers
+
+def compile_simulation(step, entities):
+    entity_set = set(entities)
+
+    neurons = [e for e in entities if type(e) is SnnBase.SpikingNeuron]
+    pulsars = [e for e in entities if type(e) is SnnBase.Pulsar]
+    # spikers with a stream of their own keep it, as objects
+    spikers = [e for e in entities if type(e) is SnnBase.PoissonSpiker and e.rng is random]
+
+    groups = _compile_neurons(neurons)
+    if pulsars:
+        groups.append(_compile_pulsars(pulsars))
+    if spikers:
+        groups.append(_compile_poisson(spikers))
+
+    # where each compiled entity went
+    placement = {}
+    for pop, members in groups:
+        for i, m in enumerate(members):
+            placement[m] = (pop, i)
+
+    lif_targets = set(neurons)
+
+    # a synapse is compiled if it's in the entity list, idle, and only joins compiled entities
+    synapse_sources = {}
+    for pop, members in groups:
+        for m in members:
+            for syn in m.synapses:
+                synapse_sources.setdefault(syn, []).append(m)
+
+    # synapses that are also fed by something that isn't compiled have to stay objects
+    fed_elsewhere = set()
+    for e in entities:
+        if e not in placement:
+            fed_elsewhere.update(getattr(e, "synapses", ()))
+
+    managers = [e for e in entities if type(e) is DopamineStdp.RewardManager]
+
+    compiled_synapses = set()
+    plastic_keys = {}
+    for syn in synapse_sources:
+        if syn not in entity_set or syn in fed_elsewhere or not _is_idle(syn):
+            continue
+
+        if not all(t in lif_targets for t in syn.targets):
+            continue
+
+        if type(syn) is SnnBase.Synapse:
+            compiled_synapses.add(syn)
+        elif type(syn) in (Stdp.StdpSynapse, DopamineStdp.DopamineStdpSynapse) and len(synapse_sources[syn]) == 1:
+            key = _plastic_key(syn, managers)
+            if key is not None:
+                compiled_synapses.add(syn)
+                plastic_keys[syn] = key
+
+    # gather (source, target) pairs per pair of populations, and kind of synapse
+    pairs = {}
+    for syn in compiled_synapses:
+        for source in synapse_sources[syn]:
+            src_pop, src_i = placement[source]
+            for target in syn.targets:
+                tgt_pop, tgt_i = placement[target]
+
+                entry = pairs.setdefault((src_pop, tgt_pop, plastic_keys.get(syn)), ([], [], []))
+                entry[0].append(src_i)
+                entry[1].append(tgt_i)
+                entry[2].append(syn)
+
+    projections = []
+    for (src_pop, tgt_pop, key), (src_i, tgt_i, syns) in pairs.items():
+        if key is None:
+            eff = np.array([s.efficiency for s in syns])
+            delay = np.array([s.delay for s in syns])
+            proj = Projections.SparseProjection.connect_pairs(src_pop, tgt_pop, src_i, tgt_i, eff, delay)
+        else:
+            proj = _connect_plastic(key, src_pop, tgt_pop, syns, src_i, tgt_i)
+
+        projections.append(proj)
+
+    views = {m: pop[i] for m, (pop, i) in placement.items()}
+
+    # hook whatever wasn't compiled back up to the populations
+    for m, (pop, i) in placement.items():
+        for syn in m.synapses:
+            if syn not in compiled_synapses:
+                pop.add_neuron_synapse(i, syn)
+
+        for listener in m.spike_listeners:
+            if listener not in compiled_synapses:
+                pop.add_neuron_listener(i, listener)
+
+    fallback = [e for e in entities if e not in placement and e not in compiled_synapses]
+
+    reachable = list(fallback)
+    for m in placement:
+        reachable += [syn for syn in m.synapses if syn not in compiled_synapses]
+    for e in fallback:
+        reachable += getattr(e, "synapses", [])
+
+    for obj in reachable:
+        targets = getattr(obj, "targets", None)
+        if isinstance(targets, list):
+            obj.targets = [views.get(t, t) for t in targets]
+
+        if type(obj) is SnnBase.Sampler and obj.source in views:
+            obj.source = views[obj.source]
+
+    return CompiledSimulation(step, [pop for pop, _ in groups], projections, fallback, views)
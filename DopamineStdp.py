@@ -5,7 +5,10 @@ Created on Mon Mar 28 20:20:06 2016
 @author: boldingd
 """
 
+import math
+
 import SnnBase
+import Stdp
 
 #TODO: it might be simpler to make DopSyn's require a reward manager as an argument and not bother with an Observer list
 #      that would make the reward manager a little simpler too
@@ -17,53 +20,190 @@ import SnnBase
 #      it would also clean up DopSyn a little too, because right now it's accumulating r, the external reward
 #      it would also remove an order-ambiguity about when in the exchange step the reward manager's exchange method is called
 
+# LTD slightly dominates in Izhikevitch model, and dopamine time-dynamics are __slow__
+# (tau_p requires the simulation is run at at least 400Hz)
+DEFAULT_PARAMETERS = Stdp.StdpParameters.shared(A_p=0.015, tau_p=0.0025, A_m=0.02, tau_m=0.0035, tau_c=15.0)
+
+# as with Stdp.StdpSynapse, a clock makes the M and P traces lazy (c still decays every step)
+#
+# event-driven mode (connect with event_driven=True, needs a clock and a reward manager):
+# between spikes c decays exponentially and the manager's r relaxes exponentially to its equilibrium,
+# so the weight change r * c integrated over the gap has a closed form.  The synapse then isn't touched
+# every step; it settles up (integral, c decay, clamp) when a spike comes along, when it's sampled,
+# and when the manager's reward jumps.  NB: clamping only happens when it settles.
+# A reward_signal can't be used with it, since only the manager's r has a closed form.
+#
+# frozen (or a frozen Neuromodulators.PlasticitySwitch) turns learning off: spikes are passed on with a
+# fixed efficiency, the traces and tag aren't bumped and reward is ignored.  Stepped traces and tag aren't
+# decayed while frozen either: the frozen steps are counted and the decay made up in one go when it's thawed,
+# so a frozen spell looks the same to stepped and event-driven synapses.
+#
+# as with Stdp.StdpSynapse, the constants live in params, a shared Stdp.StdpParameters
 class DopamineStdpSynapse:
-    def __init__(self, delay, efficiency, min_efficiency, max_efficiency):
-        self.delay = delay
-        self.min_efficiency = min_efficiency
-        self.max_efficiency = max_efficiency
+    # as with Stdp.StdpSynapse, no per-instance __dict__
+    __slots__ = ("params", "efficiency", "M", "P", "_line", "targets", "c", "r", "clock", "_trace_time",
+                 "reward_source", "_c_time", "reward_signal", "frozen", "plasticity_switch", "_held")
+    
+    def __init__(self, delay, efficiency, min_efficiency, max_efficiency, clock=None, params=None):
+        if params is None:
+            params = DEFAULT_PARAMETERS
+            
+        if params.tau_c is None:
+            raise ValueError("dopamine synapses need parameters with a tau_c")
+            
+        self.params = params.replace(delay=delay, min_efficiency=min_efficiency, max_efficiency=max_efficiency)
         
         self.efficiency = efficiency
         
         self.M = 0.0 # LTD term
-        self.A_m = 0.02 # LTD slightly dominates in Izhikevitch model
-        self.tau_m = 0.0035
-        
         self.P = 0.0 # LTP term
-        self.A_p = 0.015
-        self.tau_p = 0.0025 # requires the simulation is run at at least 400Hz
         
-        self.waiting_spikes = []
-        self.outgoing_spikes = []
+        self._line = SnnBase.DelayLine()
         self.targets = []
         
         self.c = 0.0 # dopamine tag variable
-        self.tau_c = 15.0 # dopamine time-dynamics are __slow__
         self.r = 0.0 # store the reward signal
         
+        self.clock = clock
+        self._trace_time = 0.0
+        
+        # set by RewardManager.add_event_rewardable, in event-driven mode
+        self.reward_source = None
+        self._c_time = 0.0
+        
+        # a Neuromodulators.ModulatorSignal, read every step on top of any reward() calls
+        self.reward_signal = None
+        
+        self.frozen = False
+        self.plasticity_switch = None
+        
+        # [steps, dt] of decay owed since it was frozen, or None
+        self._held = None
+        
+    A_p = Stdp.parameter("A_p")
+    tau_p = Stdp.parameter("tau_p")
+    A_m = Stdp.parameter("A_m")
+    tau_m = Stdp.parameter("tau_m")
+    tau_c = Stdp.parameter("tau_c")
+    delay = Stdp.parameter("delay")
+    min_efficiency = Stdp.parameter("min_efficiency")
+    max_efficiency = Stdp.parameter("max_efficiency")
+        
+    def is_frozen(self):
+        return self.frozen or (self.plasticity_switch is not None and self.plasticity_switch.frozen)
+        
+    _hold = Stdp.StdpSynapse._hold
+        
+    def _thaw(self):
+        # apply the decay held while frozen (lazy traces and event-driven tags catch up by the clock)
+        steps, dt = self._held
+        self._held = None
+        
+        decay_M, decay_P, decay_c = self.params.decay(dt)
+        
+        if self.clock is None:
+            self.M *= (1.0 - decay_M) ** steps
+            self.P *= (1.0 - decay_P) ** steps
+            
+        if self.reward_source is None:
+            self.c *= (1.0 - decay_c) ** steps
+        
+    def _catch_up(self):
+        gap = self.clock.time - self._trace_time
+        
+        if gap > 0.0:
+            p = self.params
+            self.M *= math.exp(-1.0 * gap / p.tau_m)
+            self.P *= math.exp(-1.0 * gap / p.tau_p)
+            
+            self._trace_time = self.clock.time
+            
+    def settle(self, now):
+        """event-driven mode: apply the weight change since the synapse was last settled, in one go
+        """
+        gap = now - self._c_time
+        
+        if gap > 0.0:
+            rm = self.reward_source
+            p = self.params
+            k = 1.0 / rm.tau + 1.0 / p.tau_c
+            
+            # integral of (eql + (r0 - eql) * exp(-t / tau)) * c * exp(-t / tau_c) over the gap
+            decay = math.exp(-1.0 * gap / p.tau_c)
+            
+            if self.is_frozen():
+                self.c *= decay
+                self._c_time = now
+                return
+                
+            change = rm.equilibrium * self.c * p.tau_c * (1.0 - decay)
+            change += (rm.reward_at(self._c_time) - rm.equilibrium) * self.c * (1.0 - math.exp(-1.0 * k * gap)) / k
+            
+            self.efficiency += change
+            
+            if self.efficiency > p.max_efficiency:
+                self.efficiency = p.max_efficiency
+            elif self.efficiency < p.min_efficiency:
+                self.efficiency = p.min_efficiency
+                
+            self.c *= decay
+            self._c_time = now
+            
+    def settle_now(self):
+        """event-driven mode: settle up to now (PlasticitySwitch does, before freezing or thawing)
+        """
+        if self.reward_source is not None:
+            self.settle(self.clock.time)
+        
     def add_spike(self, magnitude):
+        if self.is_frozen():
+            self._line.add(magnitude)
+            return
+            
+        if self._held is not None:
+            self._thaw()
+            
+        if self.clock is not None:
+            self._catch_up()
+            
+        if self.reward_source is not None:
+            self.settle(self.clock.time)
+            
         # every time we receive a spike, add A+ to P
-        self.P += self.A_p
+        self.P += self.params.A_p
         
         # apply to tag (c) rather than efficiency directly
-        self.c += self.M * self.max_efficiency
-        
-        ds = SnnBase.DelayedSpike(self.delay, magnitude)
+        self.c += self.M * self.params.max_efficiency
         
-        self.waiting_spikes.append(ds)
+        self._line.add(magnitude)
     
     def add_target(self, target):
         self.targets.append(target)
         
     def get_sample(self):
+        if self.reward_source is not None:
+            self.settle(self.clock.time)
+            
         return self.efficiency
         
     def notify_of_spike(self):
+        if self.is_frozen():
+            return
+            
+        if self._held is not None:
+            self._thaw()
+            
+        if self.clock is not None:
+            self._catch_up()
+            
+        if self.reward_source is not None:
+            self.settle(self.clock.time)
+            
         # every time the post-synaptic fires, subtract A- from M
-        self.M -= self.A_m
+        self.M -= self.params.A_m
         
         # apply to tag (c) rather than efficiency directly
-        self.c += self.P * self.max_efficiency
+        self.c += self.P * self.params.max_efficiency
         
 #==============================================================================
 #     def prepare(self):
@@ -92,66 +232,134 @@ class DopamineStdpSynapse:
         # moved to step because r*c needs to be multilied by dt
         # should work, as long as spike exchanges only happen during exchange step
     
-        # apply (time-adjusted!) tag
-        self.efficiency += self.r * self.c * dt
-         
-        # clamp to allowed range
-        if self.efficiency > self.max_efficiency:
-            self.efficiency = self.max_efficiency
-        elif self.efficiency < self.min_efficiency:
-            self.efficiency = self.min_efficiency            
+        p = self.params
+        
+        # frozen, reward is ignored and the decay is held
+        if self.is_frozen():
+            self.r = 0.0
+            self._hold(dt)
+            self._line.step(dt, p.delay)
+            return
+            
+        if self._held is not None:
+            self._thaw()
+            
+        if self.reward_source is None:
+            r = self.r
+            if self.reward_signal is not None:
+                r += self.reward_signal.value
+                
+            # apply (time-adjusted!) tag
+            self.efficiency += r * self.c * dt
+             
+            # clamp to allowed range
+            if self.efficiency > p.max_efficiency:
+                self.efficiency = p.max_efficiency
+            elif self.efficiency < p.min_efficiency:
+                self.efficiency = p.min_efficiency            
              
         # reset reward accumulator
         self.r = 0.0        
         
         # M, P and c exponentially decay to 0
-        delta_M = -1.0 * self.M * (dt / self.tau_m)
-        self.M += delta_M
+        decay_M, decay_P, decay_c = p.decay(dt)
         
-        delta_P = -1.0 * self.P * (dt / self.tau_p)
-        self.P += delta_P
+        if self.clock is None:
+            self.M += -1.0 * self.M * decay_M
+            self.P += -1.0 * self.P * decay_P
         
-        delta_c = -1.0 * self.c * (dt / self.tau_c)
-        self.c += delta_c
+        if self.reward_source is None:
+            self.c += -1.0 * self.c * decay_c
         
         # spike, as basic delayed neuron
-        temp_spikes = self.waiting_spikes
-        self.waiting_spikes = []
-        self.outgoing_spikes = []
+        self._line.step(dt, p.delay)
 
-        for spike in temp_spikes:
-            spike.remaining_delay -= dt
-            
-            if spike.remaining_delay <= 0.0:
-                self.outgoing_spikes.append(spike)                
-            else:
-                self.waiting_spikes.append(spike)
+    @classmethod
+    def batch_step(cls, synapses, dt):
+        # the same update as step, inlined; neighbours usually share a parameter set
+        last = None
+        for s in synapses:
+            p = s.params
+            if p is not last:
+                last = p
+                decay_M, decay_P, decay_c = p.decay(dt)
+
+            if s.is_frozen():
+                s.r = 0.0
+                s._hold(dt)
+                continue
+
+            if s._held is not None:
+                s._thaw()
+
+            if s.reward_source is None:
+                r = s.r
+                if s.reward_signal is not None:
+                    r += s.reward_signal.value
+
+                efficiency = s.efficiency + r * s.c * dt
+
+                if efficiency > p.max_efficiency:
+                    efficiency = p.max_efficiency
+                elif efficiency < p.min_efficiency:
+                    efficiency = p.min_efficiency
+
+                s.efficiency = efficiency
+
+            if s.reward_source is None:
+                s.c += -1.0 * s.c * decay_c
+
+            s.r = 0.0
+
+            if s.clock is None:
+                s.M += -1.0 * s.M * decay_M
+                s.P += -1.0 * s.P * decay_P
+
+        SnnBase.step_delay_lines(synapses, dt, [s.params.delay for s in synapses])
                 
     def exchange(self):
-        for s in self.outgoing_spikes:
+        if self._line.outgoing_count:
+            if self.reward_source is not None:
+                self.settle(self.clock.time)
+                
+            m = self.efficiency * self._line.outgoing
             for t in self.targets:
-                t.add_spike(self.efficiency * s.magnitude)
+                t.add_spike(m)
                 
     def reward(self, r):
         self.r += r # accumulate reward signals
                     # note: r is reset to 0 in step
         
     @staticmethod
-    def connect(source, target, delay, efficiency, min_efficiency, max_efficiency, reward_manager=None):
-        s = DopamineStdpSynapse(delay, efficiency, min_efficiency, max_efficiency)
+    def connect(source, target, delay, efficiency, min_efficiency, max_efficiency, reward_manager=None, clock=None, event_driven=False,
+                reward_signal=None, params=None):
+        if event_driven and (reward_manager is None or clock is None):
+            raise ValueError("event-driven dopamine synapses need a reward manager and a clock")
+            
+        if event_driven and reward_signal is not None:
+            raise ValueError("event-driven dopamine synapses only take reward from their reward manager")
+            
+        s = DopamineStdpSynapse(delay, efficiency, min_efficiency, max_efficiency, clock, params)
         
         s.add_target(target)
         source.add_synapse(s)
         
         target.add_spike_listener(s)
         
-        if reward_manager is not None:
+        s.reward_signal = reward_signal
+        
+        if event_driven:
+            reward_manager.add_event_rewardable(s)
+        elif reward_manager is not None:
             reward_manager.add_rewardable(s)
         
         return s
 
 # assumption: add_reward will be called only during exchange step
 # TODO: try to get the pending queue out of this thing
+#
+# event rewardables aren't handed r every step; they read the exact relaxation curve
+# (reward_at) when they settle, and are all settled just before the reward jumps
 class RewardManager:
     def __init__(self, equilibrium, tau):
         self.equilibrium = equilibrium
@@ -160,26 +368,64 @@ class RewardManager:
         self.r = equilibrium
         
         self.rewardables = list()
+        self.event_rewardables = list()
+        self.signals = list()
         
         self.pending_rewards = list()
         
+        self.time = 0.0
+        self._jump_time = 0.0
+        self._jump_r = equilibrium
+        
     def step(self, dt):
+        self.time += dt
+        
         dr = -1.0 * (self.r - self.equilibrium) * (dt / self.tau)
         
+        if self.pending_rewards:
+            for rw in self.event_rewardables:
+                rw.settle(self.time)
+                
+            self._jump_r = self.reward_at(self.time)
+            self._jump_time = self.time
+        
         for reward in self.pending_rewards:
             dr += reward
+            self._jump_r += reward
 
         self.pending_rewards.clear()
             
         self.r += dr
         
+    def reward_at(self, t):
+        """r at time t (since the last jump), relaxing exactly rather than per step
+        """
+        return self.equilibrium + (self._jump_r - self.equilibrium) * math.exp(-1.0 * (t - self._jump_time) / self.tau)
+        
+    def last_jump(self):
+        """(time, r) right after the last reward jump, which with equilibrium and tau gives the whole curve
+        """
+        return self._jump_time, self._jump_r
+        
     def exchange(self):
         for rw in self.rewardables:
             rw.reward(self.r)
             
+        for signal in self.signals:
+            signal.set(self.r)
+            
     def add_rewardable(self, rewardable):
         self.rewardables.append(rewardable)
         
+    def add_signal(self, signal):
+        """publish r to a Neuromodulators.ModulatorSignal every step, instead of calling reward() on each reader
+        """
+        self.signals.append(signal)
+        
+    def add_event_rewardable(self, rewardable):
+        rewardable.reward_source = self
+        self.event_rewardables.append(rewardable)
+        
     def add_reward(self, reward):
         self.pending_rewards.append(reward)
 
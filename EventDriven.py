@@ -0,0 +1,182 @@
+"""
+An event-driven alternative to SnnBase.run_simulation.
+
+Instead of stepping every entity at every dt, the simulation keeps a priority queue of spike deliveries
+and scheduled source firings.  Neurons are advanced analytically from one event to the next, so a quiet
+network costs in proportion to the number of spikes rather than the number of ticks.
+
+Supported entities: SpikingNeuron (with constant SnnBase.Current currents), Pulsar, NaiveRandomSpiker,
+PoissonSpiker, Synapse and Counter.  Anything else raises an SnnError, since it would need stepping.
+
+NB: time is continuous here, so results differ slightly from the fixed-step run.  Leak is exact
+exponential decay (not forward Euler), delays are not rounded to ticks, and PoissonSpiker fires with
+exponential gaps rather than a per-tick coin flip.
+"""
+
+import heapq
+import itertools
+import math
+
+import SnnBase
+
+
+_DELIVER = 0
+_SOURCE = 1
+_THRESHOLD = 2
+
+
+class _NeuronState:
+    """analytic solution for a SpikingNeuron between events:
+    charge relaxes towards v_inf at rate k
+    """
+    def __init__(self, neuron):
+        self.neuron = neuron
+
+        k = neuron.tau_mult
+        drive = neuron.eql * neuron.tau_mult
+
+        for current in neuron.currents:
+            if type(current) is not SnnBase.Current:
+                raise SnnBase.SnnError("event-driven neurons only support constant SnnBase.Current currents")
+
+            k += current.conductance
+            drive += current.conductance * current.eql
+
+        self.k = k
+        self.v_inf = drive / k
+
+        self.last_time = 0.0
+
+        # bumped whenever the charge changes, so stale threshold events can be told apart
+        self.version = 0
+
+    def advance(self, t):
+        gap = t - self.last_time
+
+        if gap > 0.0:
+            n = self.neuron
+            n.charge = self.v_inf + (n.charge - self.v_inf) * math.exp(-1.0 * self.k * gap)
+
+            self.last_time = t
+
+    def crossing_time(self):
+        """when the charge will drift over threshold on its own, or None if it never will
+        """
+        n = self.neuron
+
+        if self.v_inf <= n.threshold or n.charge >= n.threshold:
+            return None
+
+        return self.last_time + math.log((self.v_inf - n.charge) / (self.v_inf - n.threshold)) / self.k
+
+
+class EventSimulation:
+    def __init__(self, entities):
+        self.time = 0.0
+
+        self._queue = []
+        self._seq = itertools.count()
+
+        self._neurons = {}
+
+        sources = []
+
+        for entity in entities:
+            kind = type(entity)
+
+            if kind is SnnBase.SpikingNeuron:
+                self._neurons[entity] = _NeuronState(entity)
+            elif kind in (SnnBase.Pulsar, SnnBase.NaiveRandomSpiker, SnnBase.PoissonSpiker):
+                sources.append(entity)
+            elif kind in (SnnBase.Synapse, SnnBase.Counter):
+                pass # driven entirely by the events of their sources
+            else:
+                raise SnnBase.SnnError("{} is not supported by the event-driven engine".format(kind.__name__))
+
+        for source in sources:
+            self._push(source.first_spike_gap(), _SOURCE, source, None)
+
+        for state in self._neurons.values():
+            self._schedule_crossing(state)
+
+    def _push(self, time, kind, obj, value):
+        heapq.heappush(self._queue, (time, next(self._seq), kind, obj, value))
+
+    def _schedule_crossing(self, state):
+        t = state.crossing_time()
+
+        if t is not None:
+            self._push(t, _THRESHOLD, state, state.version)
+
+    def _emit(self, t, entity, magnitude):
+        for syn in entity.synapses:
+            if type(syn) is not SnnBase.Synapse:
+                raise SnnBase.SnnError("{} is not supported by the event-driven engine".format(type(syn).__name__))
+
+            for target in syn.targets:
+                self._push(t + syn.delay, _DELIVER, target, syn.efficiency * magnitude)
+
+        for listener in entity.spike_listeners:
+            if type(listener) is not SnnBase.Counter:
+                raise SnnBase.SnnError("{} is not supported by the event-driven engine".format(type(listener).__name__))
+
+            listener.time = t
+            listener.notify_of_spike()
+
+    def _fire(self, t, state):
+        n = state.neuron
+        n.charge = n.eql
+
+        state.version += 1
+        self._schedule_crossing(state)
+
+        self._emit(t, n, n.magnitude)
+
+    def _deliver(self, t, target, magnitude):
+        state = self._neurons.get(target)
+
+        if state is not None:
+            state.advance(t)
+            target.charge += magnitude
+            state.version += 1
+
+            if target.charge >= target.threshold:
+                self._fire(t, state)
+            else:
+                self._schedule_crossing(state)
+        elif type(target) is SnnBase.Counter:
+            target.time = t
+            target.add_spike(magnitude)
+        else:
+            raise SnnBase.SnnError("{} is not supported by the event-driven engine".format(type(target).__name__))
+
+    def run_until(self, stop_time):
+        # as with SnnBase.Simulation, a stop time that's already passed does nothing
+        if stop_time <= self.time:
+            return
+
+        queue = self._queue
+
+        while queue and queue[0][0] < stop_time:
+            t, _, kind, obj, value = heapq.heappop(queue)
+
+            if kind == _DELIVER:
+                self._deliver(t, obj, value)
+            elif kind == _SOURCE:
+                self._emit(t, obj, obj.magnitude)
+                self._push(t + obj.next_spike_gap(), _SOURCE, obj, None)
+            elif value == obj.version: # stale crossings are simply dropped
+                obj.advance(t)
+                self._fire(t, obj)
+
+        # bring every neuron up to date, so charges can be read after the run
+        for state in self._neurons.values():
+            state.advance(stop_time)
+
+        self.time = stop_time
+
+def run_event_simulation(stop_time, entities):
+    sim = EventSimulation(entities)
+    sim.run_until(stop_time)
+
+    return sim
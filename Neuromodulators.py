@@ -0,0 +1,125 @@
+"""
+Neuromodulator signals, channels and plasticity switches, read by reference.
+
+A ModulatorSignal holds one value (a reward, say) that any number of plastic synapses or projections read
+when they step, rather than each being handed it with a reward() call every tick.  Publishing a new value
+costs the same whether one synapse or a hundred thousand read it.
+
+    signal = Neuromodulators.ModulatorSignal()
+    manager.add_signal(signal)                         # a DopamineStdp.RewardManager publishes its r
+    proj = Projections.DopamineStdpProjection.connect(..., reward_signal=signal)
+
+The signal is an entity: add it to the simulation.  Values set (or pulsed) during a tick are latched in
+the next prepare, so everyone reading it during a step sees the same value, whatever order they run in.
+
+A ModulatorBank is a set of named channels (reward, error, novelty, ...) that whole projections subscribe to:
+
+    bank = Neuromodulators.ModulatorBank(["reward", "error"])
+    bank.subscribe(proj, "error", weight_gain=-0.5)   # proj is a Projections.DopamineStdpProjection
+    ...
+    bank["error"].set(total_error)                    # rather than handing it to each synapse
+"""
+
+
+class ModulatorSignal:
+    def __init__(self, level=0.0, name=None):
+        self.name = name
+
+        self.level = level
+        self.value = level
+
+        self._pulses = 0.0
+
+    def set(self, level):
+        """set the level, which holds until it's set again
+        """
+        self.level = level
+
+    def pulse(self, amount):
+        """add to the value for one step only
+        """
+        self._pulses += amount
+
+    def prepare(self):
+        self.value = self.level + self._pulses
+        self._pulses = 0.0
+
+    def step(self, dt):
+        pass
+
+    def get_sample(self):
+        return self.value
+
+
+class ModulatorBank:
+    """Named ModulatorSignals, latched together.  Add the bank to the simulation, not its channels.
+    """
+
+    def __init__(self, names=()):
+        self.channels = {}
+
+        for name in names:
+            self.add_channel(name)
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def add_channel(self, name, level=0.0):
+        if name in self.channels:
+            raise ValueError("there is already a channel called {}".format(name))
+
+        signal = ModulatorSignal(level, name)
+        self.channels[name] = signal
+
+        return signal
+
+    def subscribe(self, projection, name, tag_gain=0.0, weight_gain=0.0):
+        """have a projection read one channel every step (see DopamineStdpProjection.subscribe)
+        """
+        projection.subscribe(self.channels[name], tag_gain, weight_gain)
+
+    def prepare(self):
+        for signal in self.channels.values():
+            signal.prepare()
+
+    def step(self, dt):
+        pass
+
+
+class PlasticitySwitch:
+    """Turns learning off (and on again) for everything added to it, e.g. for the test phases of an experiment.
+    Frozen synapses and projections pass spikes on with fixed weights, ignore reward and don't bump their
+    traces or tags.  Nor do they decay them every step: the decay is held and made up in one go once thawed.
+    It's read by reference, so a controller can flip it mid-run; it takes effect from the next step.
+    Event-driven members are settled up as it flips, so none of a frozen spell is rewarded (or vice versa).
+    """
+
+    def __init__(self, frozen=False):
+        self.frozen = frozen
+
+        self.members = []
+
+    def _settle_members(self):
+        for plastic in self.members:
+            settle_now = getattr(plastic, "settle_now", None)
+            if settle_now is not None:
+                settle_now()
+
+    def freeze(self):
+        if not self.frozen:
+            self._settle_members()
+
+        self.frozen = True
+
+    def thaw(self):
+        if self.frozen:
+            self._settle_members()
+
+        self.frozen = False
+
+    def add(self, plastic):
+        plastic.plasticity_switch = self
+        self.members.append(plastic)
@@ -0,0 +1,451 @@
+"""
+Run an array-backed SpikingNetwork.Network across several worker processes.
+
+The clusters are split between workers.  Each worker owns the state of its populations and of every
+projection into them, and steps them with the usual prepare / step / exchange phases.  Spike flags of
+populations that other workers listen to are published to shared memory, tick by tick.
+
+Workers only need to sync as often as the shortest delay between partitions: a spike can't reach another
+partition sooner than that, so each worker runs that many ticks (the lookahead) on its own, then waits on a
+barrier and hands the remote spikes of the whole window to its projections, each marked with how many ticks
+late it is.  Buffers are double-buffered by window parity, so one barrier per window is enough.  Zero-delay
+links between partitions (the connectors' default) mean a lookahead of one tick, i.e. lock-step.
+
+Results match a single-process SnnBase.Simulation of the same network tick for tick, and the final state
+(charges, efficiencies, recorded spikes, generator states, ...) is copied back into the parent's objects after
+every run.  Only plain data is copied: attributes that refer to other objects (currents, signals, switches,
+parameter sets) are left pointing at the parent's own objects.  A worker that dies raises SnnError in the parent.
+
+Only networks made entirely of population clusters and projections are supported.  Population-level
+listeners with a step method (e.g. Populations.SpikeRecorder) are stepped by the worker that owns the
+population they listen to.
+
+Reward-modulated projections need whatever rewards them (a DopamineStdp.RewardManager, ModulatorSignals
+or a ModulatorBank, and whatever adds the rewards) passed as global_entities.  Every worker runs its own
+copy of those, after its share of the network, so they must only depend on each other and on time (a
+reward schedule, say), not on spikes, which each worker only sees part of.  Their state is copied back from
+the first worker.  A dopamine projection that nothing in global_entities would reward raises SnnError,
+rather than silently never getting any reward.
+"""
+
+import math
+import multiprocessing
+import queue
+import traceback
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import SnnBase
+import SpikingNetwork
+
+
+# references to other simulation objects, never looked into
+_LINKS = frozenset(["source", "target", "projections", "spike_listeners", "_neuron_synapses", "_neuron_listeners"])
+
+_SCALARS = (int, float, complex, bool, str, bytes, type(None), np.generic)
+
+def _is_data(value):
+    """true for plain state (numbers, arrays, and lists, tuples and dicts of them), which is copied back
+    after a run.  Anything else is a reference to some object (a current, a signal, a switch, a parameter
+    set, ...), which the parent must keep sharing rather than get a copy of.
+    """
+    if isinstance(value, _SCALARS):
+        return True
+
+    if isinstance(value, np.ndarray):
+        return value.dtype != object
+
+    if isinstance(value, (list, tuple)):
+        return all(_is_data(v) for v in value)
+
+    if isinstance(value, dict):
+        return all(_is_data(k) and _is_data(v) for k, v in value.items())
+
+    return False
+
+def _generators(obj):
+    """the numpy Generators an object draws from: its own, directly or in a list, and those of the objects
+    in its lists (noise sources, say).  Their states are copied back, so the parent's streams carry on
+    from where the workers left them.
+    """
+    found = []
+
+    for k, v in obj.__dict__.items():
+        if k in _LINKS:
+            continue
+
+        for item in (v if isinstance(v, (list, tuple)) else [v]):
+            if isinstance(item, np.random.Generator):
+                found.append(item)
+            elif isinstance(v, (list, tuple)) and hasattr(item, "__dict__"):
+                found += [g for g in item.__dict__.values() if isinstance(g, np.random.Generator)]
+
+    return found
+
+def _state(obj):
+    data = {k: v for k, v in obj.__dict__.items() if k not in _LINKS and _is_data(v)}
+
+    return data, [g.bit_generator.state for g in _generators(obj)]
+
+def _restore(obj, state):
+    data, generator_states = state
+
+    obj.__dict__.update(data)
+
+    for g, g_state in zip(_generators(obj), generator_states):
+        g.bit_generator.state = g_state
+
+
+class _SpikeBuffer:
+    """(window x replicas x count) bool arrays in shared memory, two of them, one per window parity
+    """
+    def __init__(self, population, window, name=None):
+        shape = (2, window, population.replicas, population.count)
+        size = int(np.prod(shape))
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self.shm.name
+        self.shape = shape
+        self.array = np.ndarray(shape, dtype=bool, buffer=self.shm.buf)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+
+class _Worker:
+    def __init__(self, index, populations, projections, listeners, remote, published, buffers, global_entities):
+        self.index = index
+
+        self.populations = populations
+        self.projections = projections
+        self.listeners = listeners
+        self.global_entities = global_entities
+
+        # (projection, population index of its remote source)
+        self.remote = remote
+
+        # indices of this worker's populations that other workers listen to
+        self.published = published
+
+        # population index -> buffer name, for every published population
+        self.buffers = buffers
+
+    def run(self, dt, first_tick, stop_tick, window, barrier, results):
+        buffers = {}
+
+        try:
+            owned = set(map(id, self.projections))
+
+            # spikes only go straight to projections this worker owns, the rest travel through shared memory
+            for _, pop in self.populations:
+                pop.projections = [p for p in pop.projections if id(p) in owned]
+
+            mine = dict(self.populations)
+
+            buffers = {i: _SpikeBuffer(mine[i], window, self.buffers[i]) for i in self.published}
+            for proj, i in self.remote:
+                if i not in buffers:
+                    buffers[i] = _SpikeBuffer(proj.source, window, self.buffers[i])
+
+            sim = SnnBase.Simulation(dt)
+            sim.add_entities([pop for _, pop in self.populations])
+            sim.add_entities(self.projections)
+            sim.add_entities(self.listeners)
+            sim.add_entities(self.global_entities)
+
+            prepare = sim._prepare
+            step = sim._step
+            exchange = sim._exchange
+
+            publish = [(buffers[i].array, mine[i]) for i in self.published]
+            receive = [(proj, buffers[i].array) for proj, i in self.remote]
+
+            tick = first_tick
+            parity = 0
+
+            while tick < stop_tick:
+                n = min(window, stop_tick - tick)
+
+                for k in range(n):
+                    for f in prepare:
+                        f()
+
+                    for f in step:
+                        f(dt)
+
+                    for buf, pop in publish:
+                        buf[parity, k] = pop.spiked
+
+                    for f in exchange:
+                        f()
+
+                tick += n
+
+                if barrier is not None:
+                    barrier.wait()
+
+                    # a spike from window tick k should have been handed over n - 1 - k ticks ago
+                    for proj, buf in receive:
+                        for k in range(n):
+                            spikes = buf[parity, k]
+                            if spikes.any():
+                                replicas, indices = np.nonzero(spikes)
+                                proj.add_late_source_spikes(indices, replicas, n - 1 - k)
+
+                parity ^= 1
+
+            results.put((self.index, None, self._collect()))
+        except Exception:
+            if barrier is not None:
+                barrier.abort()
+            results.put((self.index, traceback.format_exc(), None))
+        finally:
+            for b in buffers.values():
+                b.close()
+
+    def _collect(self):
+        # every worker ran the same global entities, so one copy of their state will do
+        global_states = [_state(e) for e in self.global_entities] if self.index == 0 else None
+
+        return ([(i, _state(pop)) for i, pop in self.populations],
+                [_state(proj) for proj in self.projections],
+                [_state(listener) for listener in self.listeners],
+                global_states)
+
+
+def partition_clusters(network, workers):
+    """spread clusters over workers, roughly balancing neurons plus incoming synapses
+    (a cluster's incoming projections are stepped by the worker that owns it)
+    """
+    load = {}
+    for c in network.clusters:
+        load[c.population] = c.population.count * c.population.replicas
+
+    for proj in network.projections:
+        load[proj.target] += len(proj) * proj.replicas
+
+    totals = [0] * workers
+    assignment = [0] * len(network.clusters)
+
+    # heaviest first, each to the least loaded worker
+    order = sorted(range(len(network.clusters)), key=lambda i: -load[network.clusters[i].population])
+    for i in order:
+        w = totals.index(min(totals))
+        totals[w] += load[network.clusters[i].population]
+        assignment[i] = w
+
+    return assignment
+
+
+def _check_rewarded(projections, global_entities):
+    """every reward-modulated projection has to be rewarded by the global entities, which are all
+    the workers run besides the network
+    """
+    latched = set(global_entities)
+    for e in global_entities:
+        channels = getattr(e, "channels", None)
+        if isinstance(channels, dict): # a Neuromodulators.ModulatorBank
+            latched.update(channels.values())
+
+    managed = set()
+    for e in global_entities:
+        managed.update(getattr(e, "rewardables", ()))
+        managed.update(getattr(e, "event_rewardables", ()))
+
+    for p in projections:
+        if not callable(getattr(p, "reward", None)):
+            continue
+
+        signals = list(getattr(p, "channels", ()))
+        if getattr(p, "reward_signal", None) is not None:
+            signals.append(p.reward_signal)
+
+        reward_source = getattr(p, "reward_source", None)
+
+        if reward_source is not None and reward_source not in latched:
+            raise SnnBase.SnnError("a projection's reward manager has to be one of the global entities")
+
+        if any(s not in latched for s in signals):
+            raise SnnBase.SnnError("a projection's modulator signals (or their bank) have to be global entities")
+
+        if p not in managed and not signals:
+            raise SnnBase.SnnError("a reward-modulated projection isn't rewarded by any of the global entities")
+
+
+class ParallelSimulation:
+    def __init__(self, step, network, workers=None, partition=None, global_entities=()):
+        if network.synapses:
+            raise SnnBase.SnnError("parallel simulation only supports projections, not object synapses")
+
+        for c in network.clusters:
+            if not isinstance(c, SpikingNetwork.PopulationCluster):
+                raise SnnBase.SnnError("parallel simulation only supports population-backed clusters")
+
+            if c.population._neuron_synapses or c.population._neuron_listeners:
+                raise SnnBase.SnnError("parallel simulation does not support object synapses or listeners on populations")
+
+        if workers is None:
+            workers = min(len(network.clusters), multiprocessing.cpu_count())
+
+        if partition is None:
+            partition = partition_clusters(network, workers)
+
+        if len(partition) != len(network.clusters):
+            raise ValueError("partition must give a worker for every cluster")
+
+        if any(not 0 <= w < workers for w in partition):
+            raise ValueError("partition can only use workers 0 to {}".format(workers - 1))
+
+        global_entities = list(global_entities)
+        _check_rewarded(network.projections, global_entities)
+
+        self.dt = step
+        self.network = network
+        self.workers = workers
+        self.partition = list(partition)
+        self.global_entities = global_entities
+
+        # seconds between checks that no worker has died while the parent waits for results
+        self.poll = 1.0
+
+        self.ticks = 0
+        self.time = 0.0
+
+    def run_for(self, n_ticks):
+        self._run(self.ticks + n_ticks)
+
+    def run_until(self, stop_time):
+        self._run(int(math.ceil(stop_time / self.dt - 1e-9)))
+
+    def _plan(self):
+        pops = [c.population for c in self.network.clusters]
+        pop_index = {id(p): i for i, p in enumerate(pops)}
+        owner = {i: w for i, w in enumerate(self.partition)}
+
+        plans = []
+        published = set()
+
+        for w in range(self.workers):
+            populations = [(i, pops[i]) for i in range(len(pops)) if owner[i] == w]
+
+            projections = [p for p in self.network.projections if owner[pop_index[id(p.target)]] == w]
+
+            remote = [(p, pop_index[id(p.source)]) for p in projections if owner[pop_index[id(p.source)]] != w]
+            published.update(i for _, i in remote)
+
+            # plastic projections listen to their targets too, but they're stepped as projections
+            listeners = [l for _, pop in populations for l in pop.spike_listeners
+                         if callable(getattr(l, "step", None)) and l not in self.network.projections]
+
+            plans.append((populations, projections, listeners, remote))
+
+        return pops, plans, published
+
+    def lookahead(self):
+        """ticks the workers can run between syncs: the shortest delay, in ticks, of any projection between
+        partitions.  None if no projection crosses partitions, in which case workers never sync.
+        Plastic projections need their source spikes on time, so one crossing partitions means lock-step.
+        """
+        pop_index = {id(c.population): i for i, c in enumerate(self.network.clusters)}
+
+        window = None
+        for p in self.network.projections:
+            if len(p) and self.partition[pop_index[id(p.source)]] != self.partition[pop_index[id(p.target)]]:
+                if callable(getattr(p, "notify_of_spikes", None)): # plastic
+                    return 1
+
+                ticks = SnnBase.delay_ticks(float(p.delay.min()), self.dt)
+                window = ticks if window is None else min(window, ticks)
+
+        return window
+
+    def _run(self, stop_tick):
+        if stop_tick <= self.ticks:
+            return
+
+        pops, plans, published = self._plan()
+
+        window = self.lookahead()
+        if window is None:
+            window = stop_tick - self.ticks
+
+        buffers = {i: _SpikeBuffer(pops[i], window) for i in published}
+
+        try:
+            names = {i: b.name for i, b in buffers.items()}
+
+            ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else multiprocessing
+            barrier = ctx.Barrier(self.workers) if buffers else None
+            results = ctx.Queue()
+
+            procs = []
+            for w, (populations, projections, listeners, remote) in enumerate(plans):
+                mine = [i for i, _ in populations if i in published]
+
+                worker = _Worker(w, populations, projections, listeners, remote, mine, names, self.global_entities)
+                proc = ctx.Process(target=worker.run, args=(self.dt, self.ticks, stop_tick, window, barrier, results))
+                proc.start()
+                procs.append(proc)
+
+            collected = {}
+            errors = []
+            while len(collected) + len(errors) < len(procs):
+                try:
+                    w, error, state = results.get(timeout=self.poll)
+                except queue.Empty:
+                    # a worker that's killed outright never reports back, so look for one that's gone
+                    dead = [(w, proc.exitcode) for w, proc in enumerate(procs) if proc.exitcode not in (None, 0)]
+                    if dead:
+                        errors.append("worker {} exited with code {}".format(*dead[0]))
+                        break
+
+                    continue
+
+                if error is not None:
+                    errors.append(error)
+                else:
+                    collected[w] = state
+
+            if errors:
+                if barrier is not None:
+                    barrier.abort()
+
+                for proc in procs:
+                    if proc.is_alive():
+                        proc.terminate()
+
+            for proc in procs:
+                proc.join()
+        finally:
+            for b in buffers.values():
+                b.close()
+                b.shm.unlink()
+
+        if errors:
+            raise SnnBase.SnnError("parallel worker failed:\n" + errors[0])
+
+        for w, (populations, projections, listeners, remote) in enumerate(plans):
+            pop_states, proj_states, listener_states, global_states = collected[w]
+
+            for i, state in pop_states:
+                _restore(pops[i], state)
+
+            for proj, state in zip(projections, proj_states):
+                _restore(proj, state)
+
+            for listener, state in zip(listeners, listener_states):
+                _restore(listener, state)
+
+            if global_states is not None:
+                for e, state in zip(self.global_entities, global_states):
+                    _restore(e, state)
+
+        self.ticks = stop_tick
+        self.time = self.ticks * self.dt
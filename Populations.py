@@ -0,0 +1,493 @@
+"""
+Array-backed populations of spiking entities.
+
+A population holds the state of a whole cluster in NumPy arrays and advances it with one array
+operation per tick, rather than one Python method call per neuron.  Populations follow the usual
+step / exchange protocol, so they can be run with SnnBase.run_simulation next to ordinary entities.
+
+State arrays have a leading replica dimension: a population built with replicas=N advances N
+independent copies of itself (same parameters and topology, separate state) with the same array ops.
+Parameters (threshold, eql, tau, magnitude, ...) are per neuron and shared by every replica.
+"""
+
+import numpy as np
+
+import RandomStreams
+import SnnBase
+
+
+def _as_array(value, count, name):
+    """Broadcast a scalar (or check a per-neuron sequence) to a fresh float array of length count
+    """
+    arr = np.array(value, dtype=float)
+
+    if arr.ndim == 0:
+        return np.full(count, float(arr))
+
+    if arr.shape != (count,):
+        raise ValueError("{} must be a scalar or have one entry per neuron".format(name))
+
+    return arr
+
+
+class NeuronView:
+    """A stand-in for one member of a population.
+    Supports enough of the SpikingNeuron interface that object synapses, spike listeners and samplers
+    can be attached to individual population members.
+
+    Spikes added through a view go to that member in every replica; charge is read from one replica.
+    Object synapses and listeners can only be attached to single-replica populations.
+    """
+
+    def __init__(self, population, index, replica=0):
+        self.population = population
+        self.index = index
+        self.replica = replica
+
+    def add_spike(self, magnitude):
+        self.population.input[:, self.index] += magnitude
+
+    def add_synapse(self, synapse):
+        self.population.add_neuron_synapse(self.index, synapse)
+
+    def add_spike_listener(self, listener):
+        self.population.add_neuron_listener(self.index, listener)
+
+    def get_charge(self):
+        return float(self.population.charge[self.replica, self.index])
+
+    def get_sample(self):
+        return self.get_charge()
+
+
+class SpikingPopulation:
+    """Shared plumbing for populations that emit spikes.
+    Subclasses set self.spiked (replicas x count) during step; exchange then hands the spiking
+    (indices, replicas) to outgoing projections, population-level listeners and any object
+    synapses / listeners on single members.
+    """
+
+    def __init__(self, count, magnitude, replicas=1):
+        if count < 1:
+            raise ValueError("Population count must be positive")
+
+        if replicas < 1:
+            raise ValueError("Replica count must be positive")
+
+        self.count = count
+        self.replicas = replicas
+
+        self.magnitude = _as_array(magnitude, count, "magnitude")
+
+        self.spiked = np.zeros((replicas, count), dtype=bool)
+
+        # outgoing projections get add_source_spikes(indices, replicas) once per tick
+        self.projections = []
+
+        # population-level listeners get notify_of_spikes(indices, replicas) once per tick
+        self.spike_listeners = []
+
+        # object synapses and listeners attached to single members, through a NeuronView
+        self._neuron_synapses = {}
+        self._neuron_listeners = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.view(index)
+
+    def view(self, index, replica=0):
+        if index < 0 or index >= self.count:
+            raise IndexError("neuron index out of range")
+
+        if replica < 0 or replica >= self.replicas:
+            raise IndexError("replica index out of range")
+
+        return NeuronView(self, index, replica)
+
+    def exchange(self):
+        if not self.spiked.any():
+            return
+
+        replicas, indices = np.nonzero(self.spiked)
+
+        for projection in self.projections:
+            projection.add_source_spikes(indices, replicas)
+
+        for listener in self.spike_listeners:
+            listener.notify_of_spikes(indices, replicas)
+
+        if self._neuron_synapses or self._neuron_listeners:
+            for i in indices.tolist():
+                for synapse in self._neuron_synapses.get(i, ()):
+                    synapse.add_spike(float(self.magnitude[i]))
+
+                for listener in self._neuron_listeners.get(i, ()):
+                    listener.notify_of_spike()
+
+        self.spiked.fill(False)
+
+    def add_projection(self, projection):
+        self.projections.append(projection)
+
+    def add_spike_listener(self, listener):
+        self.spike_listeners.append(listener)
+
+    def _check_single_replica(self):
+        if self.replicas != 1:
+            raise SnnBase.SnnError("object synapses and listeners need a single-replica population, use projections")
+
+    def add_neuron_synapse(self, index, synapse):
+        self._check_single_replica()
+        self._neuron_synapses.setdefault(index, []).append(synapse)
+
+    def add_neuron_listener(self, index, listener):
+        self._check_single_replica()
+        self._neuron_listeners.setdefault(index, []).append(listener)
+
+
+class LifPopulation(SpikingPopulation):
+    """A population of leaky integrate-and-fire neurons, with the same dynamics as SnnBase.SpikingNeuron.
+    Parameters may be scalars (shared by the whole population) or sequences with one entry per neuron.
+
+    Incoming spikes are summed into the input array, which is applied and cleared on the next step.
+    Currents added with add_current apply to every neuron in the population, and so do noise sources
+    (PoissonNoise, GaussianNoise) added with add_noise, each drawn independently per neuron and replica.
+    """
+
+    def __init__(self, count, threshold, magnitude, leak_eql, leak_tau, replicas=1):
+        super().__init__(count, magnitude, replicas)
+
+        self.threshold = _as_array(threshold, count, "threshold")
+
+        self.eql = _as_array(leak_eql, count, "leak_eql")
+        self.tau = _as_array(leak_tau, count, "leak_tau")
+        self.tau_mult = 1.0 / self.tau
+
+        self.currents = []
+        self.noise = []
+
+        self.charge = np.tile(self.eql, (replicas, 1))
+
+        self.input = np.zeros((replicas, count))
+
+    def step(self, dt):
+        delta = (self.eql - self.charge) * self.tau_mult * dt
+
+        for current in self.currents:
+            delta += (current.eql - self.charge) * dt * current.conductance
+
+        for noise in self.noise:
+            noise.add_to(self.input, dt)
+
+        delta += self.input
+        self.input.fill(0.0)
+
+        self.charge += delta
+
+        np.greater_equal(self.charge, self.threshold, out=self.spiked)
+
+        replicas, indices = np.nonzero(self.spiked)
+        self.charge[replicas, indices] = self.eql[indices]
+
+    def add_spikes(self, indices, magnitudes, replicas=None):
+        """Vectorized add_spike: indices may repeat, their magnitudes are summed.
+        Without replicas, the spikes go to every replica.
+        """
+        if replicas is None:
+            np.add.at(self.input, (slice(None), indices), magnitudes)
+        else:
+            np.add.at(self.input, (replicas, indices), magnitudes)
+
+    def add_input(self, values):
+        """add a whole array of input, replicas x count (or one row, for every replica)
+        """
+        self.input += values
+
+    def add_current(self, current):
+        self.currents.append(current)
+
+    def add_noise(self, noise):
+        noise.check(self.count, self.replicas)
+        self.noise.append(noise)
+
+    def get_charges(self, replica=0):
+        return self.charge[replica].copy()
+
+
+class _Noise:
+    """rng works as for PoissonPopulation: a list of numpy Generators, one per replica, or a single shared
+    one.  By default, each replica of the population it's added to gets its own, seeded from the random module.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def check(self, count, replicas):
+        if self.rng is None:
+            self.rng = RandomStreams.python_seeded_generators(replicas)
+
+        for name in self.PARAMETERS:
+            if np.ndim(getattr(self, name)) != 0 and np.shape(getattr(self, name)) != (count,):
+                raise ValueError("{} must be a scalar or have one entry per neuron".format(name))
+
+        if isinstance(self.rng, (list, tuple)) and len(self.rng) != replicas:
+            raise ValueError("need one generator per replica")
+
+    def add_to(self, input, dt):
+        if isinstance(self.rng, (list, tuple)):
+            for rng, row in zip(self.rng, input):
+                row += self._draw(rng, dt, row.shape)
+        else:
+            input += self._draw(self.rng, dt, input.shape)
+
+
+class PoissonNoise(_Noise):
+    """Background spikes: each neuron gets kicks of magnitude at frequency (spikes per second), in place of
+    its own PoissonSpiker and Synapse.  The number of kicks in a tick is Poisson, not one-or-none, so
+    frequency can stand for many inputs at once (a thousand 5Hz inputs are a 5000Hz one).  That's what
+    a PoissonSpiker comes to as dt * frequency gets small (with a coarse step, neurons
+    driven by spikers fire a little more often).
+    """
+
+    PARAMETERS = ("magnitude", "frequency")
+
+    def __init__(self, magnitude, frequency, rng=None):
+        super().__init__(rng)
+
+        self.magnitude = np.array(magnitude, dtype=float)
+        self.frequency = np.array(frequency, dtype=float)
+
+        if np.any(self.frequency < 0.0):
+            raise ValueError("frequencies can't be negative")
+
+    def _draw(self, rng, dt, shape):
+        return self.magnitude * rng.poisson(dt * self.frequency, shape)
+
+
+class GaussianNoise(_Noise):
+    """A noisy current: each tick adds mean * dt + sigma * sqrt(dt) * N(0, 1) charge to each neuron,
+    so the noise comes out the same whatever the step size.
+    """
+
+    PARAMETERS = ("mean", "sigma")
+
+    def __init__(self, mean, sigma, rng=None):
+        super().__init__(rng)
+
+        self.mean = np.array(mean, dtype=float)
+        self.sigma = np.array(sigma, dtype=float)
+
+        if np.any(self.sigma < 0.0):
+            raise ValueError("sigma can't be negative")
+
+    def _draw(self, rng, dt, shape):
+        return rng.normal(self.mean * dt, self.sigma * np.sqrt(dt), shape)
+
+
+class PulsarPopulation(SpikingPopulation):
+    """A population of SnnBase.Pulsar-style sources, each firing on its own fixed period
+    """
+
+    def __init__(self, magnitude, frequency, replicas=1):
+        frequency = np.array(frequency, dtype=float, ndmin=1)
+
+        super().__init__(len(frequency), magnitude, replicas)
+
+        self.frequency = frequency
+        self.delay = 1.0 / frequency
+        self.remaining = np.tile(self.delay, (replicas, 1))
+
+    def step(self, dt):
+        self.remaining -= dt
+
+        np.less_equal(self.remaining, 0.0, out=self.spiked)
+
+        replicas, indices = np.nonzero(self.spiked)
+        self.remaining[replicas, indices] = self.delay[indices]
+
+
+class PoissonPopulation(SpikingPopulation):
+    """A population of SnnBase.PoissonSpiker-style sources: each fires on a tick with probability dt * frequency.
+    Every tick is one array draw for the whole population, rather than a random.uniform call per spiker.
+
+    rng is a list of numpy Generators, one per replica (RandomStreams.generators), so each replica has its
+    own stream and its spikes don't depend on how many replicas there are.  By default they're seeded from
+    the random module, so random.seed() still makes runs repeatable.  A single Generator is also taken,
+    and shared by every replica.
+    """
+
+    def __init__(self, magnitude, frequency, replicas=1, rng=None):
+        frequency = np.array(frequency, dtype=float, ndmin=1)
+
+        super().__init__(len(frequency), magnitude, replicas)
+
+        if np.any(frequency < 0.0):
+            raise ValueError("frequencies can't be negative")
+
+        if rng is None:
+            rng = RandomStreams.python_seeded_generators(replicas)
+
+        if isinstance(rng, (list, tuple)) and len(rng) != replicas:
+            raise ValueError("need one generator per replica")
+
+        self.rng = rng
+        self.frequency = frequency
+
+        # firing probability per tick, worked out again whenever dt or the rates change
+        self._dt = None
+        self._p = None
+        self._draws = np.zeros((replicas, self.count))
+
+    def set_frequency(self, frequency):
+        frequency = _as_array(frequency, self.count, "frequency")
+
+        if np.any(frequency < 0.0):
+            raise ValueError("frequencies can't be negative")
+
+        self.frequency = frequency
+        self._dt = None
+
+    def _fire(self, p):
+        if isinstance(self.rng, (list, tuple)):
+            for rng, row in zip(self.rng, self._draws):
+                rng.random(out=row)
+        else:
+            self.rng.random(out=self._draws)
+
+        np.less_equal(self._draws, p, out=self.spiked)
+
+    def step(self, dt):
+        if dt != self._dt:
+            self._dt = dt
+            self._p = dt * self.frequency
+
+        self._fire(self._p)
+
+
+class DrivenPoissonPopulation(PoissonPopulation):
+    """A population of SnnBase.DrivenPoissonSpiker-style sources: each fires on a tick with probability
+    dt * alpha * (drive - threshold), but the drive comes for the whole population at once.
+
+    drive is either a function of time, called once per tick with the time at the start of the tick and
+    returning a scalar, one value per channel, or a (replicas, count) array; or a table, one row (of the same
+    shapes) per sample, sample_dt seconds apart.  A table is held at its last row once it runs out, or wraps
+    around with loop (for a periodic drive, tabulate one period).
+
+    rng works as for PoissonPopulation.
+    """
+
+    def __init__(self, count, magnitude, alpha, threshold, drive, replicas=1, sample_dt=None, loop=False, rng=None):
+        super().__init__(magnitude, np.zeros(count), replicas, rng)
+
+        self.alpha = _as_array(alpha, count, "alpha")
+        self.threshold = _as_array(threshold, count, "threshold")
+
+        if callable(drive):
+            self.drive = drive
+            self.table = None
+        else:
+            if sample_dt is None or sample_dt <= 0.0:
+                raise ValueError("a drive table needs a positive sample_dt")
+
+            self.drive = None
+            self.table = np.array(drive, dtype=float)
+
+            if self.table.ndim == 0 or len(self.table) == 0:
+                raise ValueError("a drive table needs at least one sample")
+
+            # check the rows broadcast now, not on the first tick
+            np.broadcast_to(self.table[0], (replicas, count))
+
+        self.sample_dt = sample_dt
+        self.loop = loop
+
+        self.time = 0.0
+
+        self._rate = np.zeros((replicas, count))
+
+    @classmethod
+    def tabulated(cls, count, magnitude, alpha, threshold, function, duration, sample_dt, replicas=1, loop=False, rng=None):
+        """A population driven by a table of function (of time, returning what drive would), sampled every
+        sample_dt from 0 up to duration.  For a periodic drive, make duration one period, and loop.
+        """
+        # arange(0, duration, sample_dt) can overshoot by a sample, which would stretch a looped period
+        n = int(round(duration / sample_dt))
+        times = np.arange(n) * sample_dt
+        table = np.array([function(t) for t in times], dtype=float)
+
+        return cls(count, magnitude, alpha, threshold, table, replicas, sample_dt, loop, rng)
+
+    def current_drive(self):
+        if self.table is None:
+            return self.drive(self.time)
+
+        # the small nudge keeps float drift in time from landing a tick on the previous sample
+        i = int(self.time / self.sample_dt + 1e-9)
+
+        if self.loop:
+            i %= len(self.table)
+        else:
+            i = min(i, len(self.table) - 1)
+
+        return self.table[i]
+
+    def step(self, dt):
+        np.subtract(self.current_drive(), self.threshold, out=self._rate)
+        self._rate *= dt * self.alpha
+
+        self._fire(self._rate)
+
+        self.time += dt
+
+
+class SpikeRecorder:
+    """A population-level spike listener that keeps every spike, as (time, replica, index)
+    """
+
+    def __init__(self, name=None):
+        self.time = 0.0
+        self.name = name
+
+        self._times = []
+        self._replicas = []
+        self._indices = []
+
+    def step(self, dt):
+        self.time += dt
+
+    def notify_of_spikes(self, indices, replicas):
+        self._times.append(np.full(len(indices), self.time))
+        self._replicas.append(replicas)
+        self._indices.append(indices)
+
+    def get_spikes(self, replica=None):
+        """spike times and neuron indices for one replica, as (times, indices)
+        or, if replica is None, for all of them, as (times, replicas, indices)
+        """
+        if self._times:
+            times = np.concatenate(self._times)
+            replicas = np.concatenate(self._replicas)
+            indices = np.concatenate(self._indices)
+        else:
+            times = np.zeros(0)
+            replicas = np.zeros(0, dtype=np.int64)
+            indices = np.zeros(0, dtype=np.int64)
+
+        if replica is None:
+            return times, replicas, indices
+
+        mask = replicas == replica
+
+        return times[mask], indices[mask]
+
+    def get_counts(self, count, replicas=1):
+        """per-neuron spike counts, replicas x count
+        """
+        _, r, i = self.get_spikes()
+
+        counts = np.zeros((replicas, count), dtype=np.int64)
+        np.add.at(counts, (r, i), 1)
+
+        return counts
@@ -0,0 +1,996 @@
+"""
+Array-backed projections between populations.
+
+A projection holds every synapse from one population to another as compressed sparse rows:
+row i covers the synapses of source neuron i, which live at indptr[i]:indptr[i+1] in the
+per-synapse arrays (target index, efficiency, delay, min and max efficiency).
+Only the rows of sources that spiked are touched when spikes are delivered.
+
+Topology, delays and bounds are shared by every replica of the populations; efficiency has a leading
+replica dimension, so each replica learns its own weights.
+"""
+
+import numpy as np
+
+import SnnBase
+import Stdp
+
+
+def _per_synapse(value, count, name):
+    arr = np.array(value, dtype=float)
+
+    if arr.ndim == 0:
+        return np.full(count, float(arr))
+
+    if arr.shape != (count,):
+        raise ValueError("{} must be a scalar or have one entry per synapse".format(name))
+
+    return arr
+
+def _per_replica_synapse(value, replicas, count, name):
+    """efficiency-style values: one per synapse, or one per replica and synapse
+    """
+    arr = np.array(value, dtype=float)
+
+    if arr.ndim == 2:
+        if arr.shape != (replicas, count):
+            raise ValueError("{} must have one row per replica and one column per synapse".format(name))
+        return arr
+
+    return np.tile(_per_synapse(arr, count, name), (replicas, 1))
+
+def row_synapses(indptr, rows):
+    """Return the synapse indices of the given rows, concatenated in row order
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+
+    ends = np.cumsum(counts)
+    offsets = np.repeat(starts - (ends - counts), counts)
+
+    return offsets + np.arange(ends[-1] if len(ends) else 0)
+
+def all_to_all(source_count, target_count):
+    """CSR structure (indptr, indices) connecting every source to every target
+    """
+    indptr = np.arange(source_count + 1, dtype=np.int64) * target_count
+    indices = np.tile(np.arange(target_count, dtype=np.int64), source_count)
+
+    return indptr, indices
+
+def pairs_to_csr(source_count, sources, targets):
+    """CSR structure for a list of (source, target) pairs.
+    Also returns the order the pairs were sorted into, so per-pair values can be permuted to match.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+
+    order = np.argsort(sources, kind="stable")
+
+    counts = np.bincount(sources, minlength=source_count)
+
+    indptr = np.zeros(source_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    return indptr, targets[order], order
+
+def _reorder(value, order):
+    # per-pair values into CSR order; scalars (and None) apply to every synapse as they are
+    if value is None or np.ndim(value) == 0:
+        return value
+    return np.asarray(value, dtype=float)[..., order]
+
+
+class SparseProjection:
+    """Static synapses from a source population to a target population, in CSR form.
+    Delivery follows SnnBase.Synapse: efficiency * source magnitude arrives at the target
+    SnnBase.delay_ticks(delay, dt) steps after the source spikes.
+
+    Delays are turned into whole ticks on the first step; in-flight input is kept, already summed
+    per target, in a circular buffer with one row per tick of the longest delay.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay=0.0, min_efficiency=None, max_efficiency=None):
+        self.source = source
+        self.target = target
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+
+        if self.indptr.shape != (len(source) + 1,):
+            raise ValueError("indptr must have one entry per source neuron, plus one")
+
+        nnz = len(self.indices)
+
+        if self.indptr[0] != 0 or self.indptr[-1] != nnz or np.any(np.diff(self.indptr) < 0):
+            raise ValueError("indptr does not describe the indices array")
+
+        if nnz > 0 and (self.indices.min() < 0 or self.indices.max() >= len(target)):
+            raise ValueError("target index out of range")
+
+        if source.replicas != target.replicas:
+            raise ValueError("source and target populations must have the same number of replicas")
+
+        self.replicas = source.replicas
+
+        self.efficiency = _per_replica_synapse(efficiency, self.replicas, nnz, "efficiency")
+        self.delay = _per_synapse(delay, nnz, "delay")
+
+        if min_efficiency is None:
+            min_efficiency = -np.inf
+        if max_efficiency is None:
+            max_efficiency = np.inf
+
+        self.min_efficiency = _per_synapse(min_efficiency, nnz, "min_efficiency")
+        self.max_efficiency = _per_synapse(max_efficiency, nnz, "max_efficiency")
+
+        self._incoming = []
+        self._late = []
+
+        # circular buffer of summed input per target, one row per tick of delay
+        # sized on the first step, once dt is known
+        self._dt = None
+        self._delay_ticks = None
+        self._ring = None
+        self._ring_used = None
+        self._cursor = 0
+        self._out_slot = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def add_source_spikes(self, indices, replicas):
+        """Called by the source population (during exchange) with the indices of the neurons that spiked,
+        and the replica each spike happened in
+        """
+        self._incoming.append((indices, replicas))
+
+    def _take_incoming(self):
+        if len(self._incoming) == 1:
+            rows, reps = self._incoming[0]
+        else:
+            rows = np.concatenate([i for i, _ in self._incoming])
+            reps = np.concatenate([r for _, r in self._incoming])
+
+        self._incoming = []
+
+        return rows, reps
+
+    def add_late_source_spikes(self, indices, replicas, ticks_late):
+        """Like add_source_spikes, for spikes that should have been handed over ticks_late steps ago.
+        They still arrive on the tick they would have, as long as that tick hasn't passed.
+        """
+        self._late.append((indices, replicas, ticks_late))
+
+    def _build_ring(self, dt):
+        if self._dt is not None:
+            raise SnnBase.SnnError("projection delays were sized for dt={}, cannot step with dt={}".format(self._dt, dt))
+
+        self._dt = dt
+
+        self._delay_ticks = np.maximum(1, np.ceil(self.delay / dt - 1e-9)).astype(np.int64)
+
+        slots = int(self._delay_ticks.max()) if len(self._delay_ticks) else 1
+
+        self._ring = np.zeros((slots, self.replicas, len(self.target)))
+        self._ring_used = np.zeros(slots, dtype=bool)
+
+    def step(self, dt):
+        if dt != self._dt:
+            self._build_ring(dt)
+
+        cursor = self._cursor
+        slots = len(self._ring)
+
+        if self._incoming:
+            rows, reps = self._take_incoming()
+            self._schedule(rows, reps, 0, cursor, slots)
+
+        if self._late:
+            for rows, reps, late in self._late:
+                self._schedule(rows, reps, late, cursor, slots)
+
+            self._late = []
+
+        if self._ring_used[cursor]:
+            self._out_slot = cursor
+
+        self._cursor = (cursor + 1) % slots
+
+    def _scheduled_synapses(self, rows, reps, late):
+        """(replica, synapse, source, delay ticks) of every synapse the spikes of rows go out on
+        """
+        counts = self.indptr[rows + 1] - self.indptr[rows]
+
+        syn = row_synapses(self.indptr, rows)
+        src = np.repeat(rows, counts)
+        rep = np.repeat(reps, counts)
+
+        ticks = self._delay_ticks[syn]
+        if late and len(ticks) and ticks.min() <= late:
+            raise SnnBase.SnnError("spikes handed to a projection {} ticks late, after they were due".format(late))
+
+        return rep, syn, src, ticks
+
+    def _schedule(self, rows, reps, late, cursor, slots):
+        rep, syn, src, ticks = self._scheduled_synapses(rows, reps, late)
+
+        # spikes leave delay_ticks steps after they're handed over, the first of which is this one
+        self._store((cursor + ticks - 1 - late) % slots, rep, syn, src)
+
+    def _store(self, when, rep, syn, src):
+        values = self.efficiency[rep, syn] * self.source.magnitude[src]
+
+        np.add.at(self._ring, (when, rep, self.indices[syn]), values)
+        self._ring_used[when] = True
+
+    def exchange(self):
+        if self._out_slot is not None:
+            slot = self._out_slot
+            self._out_slot = None
+
+            self.target.add_input(self._ring[slot])
+
+            self._ring[slot].fill(0.0)
+            self._ring_used[slot] = False
+
+    def get_efficiencies(self, replica=0):
+        return self.efficiency[replica].copy()
+
+    def synapse_sources(self):
+        """the source neuron of each synapse
+        """
+        return np.repeat(np.arange(len(self.source), dtype=np.int64), np.diff(self.indptr))
+
+    def restructure(self, keep, sources=(), targets=(), efficiency=0.0, delay=0.0, min_efficiency=None, max_efficiency=None):
+        """Structural plasticity: drop the synapses where keep is False, and add new ones from sources to targets
+        (per-synapse values for the new ones are given in pair order, efficiency may have a row per replica).
+        The per-synapse arrays are rebuilt compacted, so the projection costs what its remaining synapses do.
+
+        Input already in flight is summed per target, so it's still delivered, dropped synapses and all (the
+        plastic projections keep it per synapse instead, and lose what was on dropped ones).  New synapses can't
+        have longer delays than the projection was first stepped with.
+
+        Returns where each old synapse went, -1 for dropped ones.
+        """
+        keep = np.asarray(keep, dtype=bool)
+        if keep.shape != self.indices.shape:
+            raise ValueError("keep must have one entry per synapse")
+
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        added = len(sources)
+
+        if targets.shape != (added,):
+            raise ValueError("new synapses need as many targets as sources")
+
+        if added and (sources.min() < 0 or sources.max() >= len(self.source) or
+                      targets.min() < 0 or targets.max() >= len(self.target)):
+            raise ValueError("new synapse index out of range")
+
+        if min_efficiency is None:
+            min_efficiency = -np.inf
+        if max_efficiency is None:
+            max_efficiency = np.inf
+
+        kept = np.flatnonzero(keep)
+
+        indptr, indices, order = pairs_to_csr(len(self.source), np.concatenate([self.synapse_sources()[kept], sources]),
+                                              np.concatenate([self.indices[kept], targets]))
+
+        def carry(values, new):
+            """a per-synapse array (synapses on the last axis) in the new layout
+            """
+            new = np.broadcast_to(new, values.shape[:-1] + (added,))
+            return np.concatenate([values[..., kept], new], axis=-1)[..., order]
+
+        # where each old synapse went, -1 for dropped ones
+        moved = np.full(len(keep), -1, dtype=np.int64)
+        moved[kept] = np.argsort(order)[:len(kept)]
+
+        self.indptr = indptr
+        self.indices = indices
+
+        self._restructure(carry, moved, _per_replica_synapse(efficiency, self.replicas, added, "efficiency"),
+                          _per_synapse(delay, added, "delay"), _per_synapse(min_efficiency, added, "min_efficiency"),
+                          _per_synapse(max_efficiency, added, "max_efficiency"))
+
+        return moved
+
+    def _restructure(self, carry, moved, efficiency, delay, min_efficiency, max_efficiency):
+        self.efficiency = carry(self.efficiency, efficiency)
+        self.delay = carry(self.delay, delay)
+        self.min_efficiency = carry(self.min_efficiency, min_efficiency)
+        self.max_efficiency = carry(self.max_efficiency, max_efficiency)
+
+        if self._dt is not None:
+            ticks = np.maximum(1, np.ceil(delay / self._dt - 1e-9)).astype(np.int64)
+
+            if len(ticks) and ticks.max() > len(self._ring):
+                raise SnnBase.SnnError("new synapses can't have longer delays than the projection already has")
+
+            self._delay_ticks = carry(self._delay_ticks, ticks)
+
+    @classmethod
+    def connect(cls, source, target, indptr, indices, efficiency, delay=0.0, min_efficiency=None, max_efficiency=None):
+        p = cls(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency)
+        source.add_projection(p)
+
+        return p
+
+    @classmethod
+    def connect_pairs(cls, source, target, sources, targets, efficiency, delay=0.0, min_efficiency=None, max_efficiency=None,
+                      **kwargs):
+        """connect from parallel lists of source and target indices
+        per-synapse values are given in pair order, anything else is passed on to connect
+        """
+        indptr, indices, order = pairs_to_csr(len(source), sources, targets)
+
+        return cls.connect(source, target, indptr, indices, _reorder(efficiency, order), _reorder(delay, order),
+                           _reorder(min_efficiency, order), _reorder(max_efficiency, order), **kwargs)
+
+
+class _PlasticProjection(SparseProjection):
+    """Shared plumbing for projections that learn.
+
+    The projection listens to its target population for post-synaptic spikes.  Spikes from both sides are
+    handed over during exchange and applied in the next prepare, source spikes first, then target spikes,
+    through _pre_spikes and _post_spikes.
+
+    Weights can change while a spike is in flight, so unlike SparseProjection the efficiency is read when a
+    spike is delivered, as with the object synapses.
+
+    frozen (or a frozen Neuromodulators.PlasticitySwitch) turns learning off: spikes are delivered with fixed
+    weights, target spikes are dropped, reward is ignored, and traces and tags aren't bumped.  Nor are they
+    decayed tick by tick: the frozen ticks are counted and the decay is made up in one go when it's thawed,
+    so the traces and tags come back as if they had decayed all along, and lazy and stepped traces agree.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency):
+        if min_efficiency is None or max_efficiency is None:
+            raise ValueError("plastic projections need a min and max efficiency")
+
+        super().__init__(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency)
+
+        # time of the last exchange, which is when the spikes handled in prepare happened
+        self._time = 0.0
+
+        self._post_incoming = []
+
+        # (replicas, synapses) whose efficiency was changed directly, to clamp at the end of prepare
+        self._touched = []
+
+        self.frozen = False
+        self.plasticity_switch = None
+
+        # ticks (all of length _held_dt) whose trace and tag decay is owed since it was frozen
+        self._held_steps = 0
+        self._held_dt = 0.0
+
+        self._build_columns()
+
+    def _build_columns(self):
+        # source neuron of each synapse, and the synapses onto each target (compressed sparse columns)
+        self._synapse_source = self.synapse_sources()
+        self._post_indptr, self._post_synapses, _ = pairs_to_csr(len(self.target), self.indices, np.arange(len(self.indices)))
+
+    def notify_of_spikes(self, indices, replicas):
+        """Called by the target population (during exchange) with the neurons that spiked
+        """
+        self._post_incoming.append((indices, replicas))
+
+    def _spiking_rows(self):
+        rows = np.concatenate([i for i, _ in self._incoming] + [i for i, _, _ in self._late])
+        reps = np.concatenate([r for _, r in self._incoming] + [r for _, r, _ in self._late])
+
+        return rows, reps
+
+    def _take_post_incoming(self):
+        cols = np.concatenate([i for i, _ in self._post_incoming])
+        reps = np.concatenate([r for _, r in self._post_incoming])
+
+        self._post_incoming = []
+
+        return cols, reps
+
+    def is_frozen(self):
+        return self.frozen or (self.plasticity_switch is not None and self.plasticity_switch.frozen)
+
+    def _hold(self, dt):
+        if self._held_steps and dt != self._held_dt:
+            self._thaw()
+
+        self._held_steps += 1
+        self._held_dt = dt
+
+    def _thaw(self):
+        """apply the decay held while frozen, then forget it
+        """
+        self._apply_held(self._held_steps, self._held_dt)
+        self._held_steps = 0
+
+    def _apply_held(self, steps, dt):
+        pass
+
+    def prepare(self):
+        if self.is_frozen():
+            self._post_incoming = []
+            return
+
+        if self._held_steps:
+            self._thaw()
+
+        # source spikes stay queued for step, which sends them on
+        if self._incoming or self._late:
+            rows, reps = self._spiking_rows()
+
+            counts = self.indptr[rows + 1] - self.indptr[rows]
+            syn = row_synapses(self.indptr, rows)
+
+            self._pre_spikes(rows, reps, np.repeat(reps, counts), syn)
+
+        if self._post_incoming:
+            cols, reps = self._take_post_incoming()
+
+            counts = self._post_indptr[cols + 1] - self._post_indptr[cols]
+            syn = self._post_synapses[row_synapses(self._post_indptr, cols)]
+
+            self._post_spikes(cols, reps, np.repeat(reps, counts), syn)
+
+        if self._touched:
+            for rep, syn in self._touched:
+                self._clamp(rep, syn)
+
+            self._touched = []
+
+    def _change_efficiency(self, rep, syn, change):
+        """add to efficiencies; the sum is clamped once all of this tick's spikes are in
+        """
+        np.add.at(self.efficiency, (rep, syn), change)
+        self._touched.append((rep, syn))
+
+    def step(self, dt):
+        if self.is_frozen():
+            self._hold(dt)
+
+        self._time += dt
+
+        super().step(dt)
+
+    def _clamp(self, rep, syn):
+        self.efficiency[rep, syn] = np.clip(self.efficiency[rep, syn], self.min_efficiency[syn], self.max_efficiency[syn])
+
+    def _build_ring(self, dt):
+        super()._build_ring(dt)
+
+        # in-flight spikes are kept as (replica, synapse, magnitude) arrays per slot
+        self._ring = [[] for _ in range(len(self._ring))]
+
+    def _store(self, when, rep, syn, src):
+        magnitude = self.source.magnitude[src]
+
+        for slot in np.unique(when).tolist():
+            mask = when == slot
+            self._ring[slot].append((rep[mask], syn[mask], magnitude[mask]))
+            self._ring_used[slot] = True
+
+    def exchange(self):
+        if self._out_slot is not None:
+            slot = self._out_slot
+            self._out_slot = None
+
+            pending = self._ring[slot]
+            self._ring[slot] = []
+            self._ring_used[slot] = False
+
+            rep = np.concatenate([r for r, _, _ in pending])
+            syn = np.concatenate([s for _, s, _ in pending])
+            magnitude = np.concatenate([m for _, _, m in pending])
+
+            self.target.add_spikes(self.indices[syn], self._read_efficiency(rep, syn) * magnitude, rep)
+
+    def _read_efficiency(self, rep, syn):
+        return self.efficiency[rep, syn]
+
+    def _restructure(self, carry, moved, efficiency, delay, min_efficiency, max_efficiency):
+        if not (np.all(np.isfinite(min_efficiency)) and np.all(np.isfinite(max_efficiency))):
+            raise ValueError("plastic projections need a min and max efficiency")
+
+        super()._restructure(carry, moved, efficiency, delay, min_efficiency, max_efficiency)
+
+        self._build_columns()
+
+        # in-flight spikes refer to synapses by index
+        if self._ring is not None:
+            for slot, pending in enumerate(self._ring):
+                remapped = []
+
+                for rep, syn, magnitude in pending:
+                    syn = moved[syn]
+                    live = syn >= 0
+
+                    if live.any():
+                        remapped.append((rep[live], syn[live], magnitude[live]))
+
+                self._ring[slot] = remapped
+                self._ring_used[slot] = bool(remapped)
+
+            if self._out_slot is not None and not self._ring_used[self._out_slot]:
+                self._out_slot = None
+
+    @classmethod
+    def connect(cls, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency, **kwargs):
+        p = cls(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency, **kwargs)
+
+        source.add_projection(p)
+        target.add_spike_listener(p)
+
+        return p
+
+
+class _TraceProjection(_PlasticProjection):
+    """Trace-based STDP.
+    Rather than a P and M trace per synapse, as Stdp.StdpSynapse keeps, there's one pre-synaptic trace P per
+    source neuron and one post-synaptic trace M per target neuron: every synapse from the same source sees the
+    same P, and every synapse onto the same target the same M, so the weight changes come out the same.
+
+    With lazy_traces, P and M aren't decayed every step: each entry keeps the time it was last brought up to
+    date, and is decayed exactly (exp(-gap / tau)) when a spike reads or bumps it.  Use get_traces to read them.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                 A_p, tau_p, A_m, tau_m, lazy_traces):
+        super().__init__(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency)
+
+        self.A_p = A_p
+        self.tau_p = tau_p
+        self.A_m = A_m
+        self.tau_m = tau_m
+
+        self.P = np.zeros((self.replicas, len(source)))
+        self.M = np.zeros((self.replicas, len(target)))
+
+        self.lazy_traces = lazy_traces
+        self._P_time = np.zeros_like(self.P)
+        self._M_time = np.zeros_like(self.M)
+
+    def _catch_up(self, trace, times, tau, reps, neurons):
+        """bring lazy trace entries up to date, if they aren't already
+        """
+        gap = self._time - times[reps, neurons]
+        trace[reps, neurons] *= np.exp(-1.0 * gap / tau)
+        times[reps, neurons] = self._time
+
+    def _pre_spikes(self, rows, reps, rep, syn):
+        tgt = self.indices[syn]
+
+        if self.lazy_traces:
+            self._catch_up(self.M, self._M_time, self.tau_m, rep, tgt)
+            self._catch_up(self.P, self._P_time, self.tau_p, reps, rows)
+
+        self._on_pre(rep, syn, self.M[rep, tgt] * self.max_efficiency[syn])
+
+        np.add.at(self.P, (reps, rows), self.A_p)
+
+    def _post_spikes(self, cols, reps, rep, syn):
+        src = self._synapse_source[syn]
+
+        if self.lazy_traces:
+            self._catch_up(self.P, self._P_time, self.tau_p, rep, src)
+            self._catch_up(self.M, self._M_time, self.tau_m, reps, cols)
+
+        self._on_post(rep, syn, self.P[rep, src] * self.max_efficiency[syn])
+
+        np.add.at(self.M, (reps, cols), -1.0 * self.A_m)
+
+    def _decay_traces(self, dt):
+        if not self.lazy_traces and not self.is_frozen():
+            self.M += -1.0 * self.M * (dt / self.tau_m)
+            self.P += -1.0 * self.P * (dt / self.tau_p)
+
+    def _apply_held(self, steps, dt):
+        # lazy traces catch up by time anyway
+        if not self.lazy_traces:
+            self.M *= (1.0 - dt / self.tau_m) ** steps
+            self.P *= (1.0 - dt / self.tau_p) ** steps
+
+    def get_traces(self, replica=0):
+        """current (P, M) traces, per source and per target neuron
+        """
+        P = self.P[replica].copy()
+        M = self.M[replica].copy()
+
+        if self.lazy_traces:
+            P *= np.exp(-1.0 * (self._time - self._P_time[replica]) / self.tau_p)
+            M *= np.exp(-1.0 * (self._time - self._M_time[replica]) / self.tau_m)
+        elif self._held_steps:
+            P *= (1.0 - self._held_dt / self.tau_p) ** self._held_steps
+            M *= (1.0 - self._held_dt / self.tau_m) ** self._held_steps
+
+        return P, M
+
+
+class StdpProjection(_TraceProjection):
+    """The array version of Stdp.StdpSynapse, with the same default parameters.
+    Changes are summed over a tick, then applied and clamped in prepare.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                 A_p=0.015, tau_p=0.0025, A_m=0.015, tau_m=0.0025, lazy_traces=False):
+        super().__init__(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                         A_p, tau_p, A_m, tau_m, lazy_traces)
+
+    def _on_pre(self, rep, syn, change):
+        self._change_efficiency(rep, syn, change)
+
+    _on_post = _on_pre
+
+    def step(self, dt):
+        self._decay_traces(dt)
+
+        super().step(dt)
+
+
+class PairStdpProjection(_PlasticProjection):
+    """Pair-based STDP, with the window of a Stdp.StdpFunction (by default the same shape as StdpSynapse's).
+    Each neuron keeps the times of its last `history` spikes in a circular buffer.  When a source neuron
+    fires, each of its synapses is weakened by the window summed over the target's recent spikes; when a
+    target fires, each synapse onto it is strengthened by the window summed over the source's recent spikes.
+    Changes are scaled by max_efficiency, as with the trace rule, and summed and clamped in prepare.
+
+    nearest=True only pairs each spike with the other side's latest spike, rather than all of them.
+    Pairs further apart than window (if given) are ignored.
+
+    As with StdpFunction, a source and target spike on the same tick (a gap of 0) count as depression.
+    Apart from that, all-pairs with enough history gives the same changes as lazy (exact) traces, which
+    count a same-tick pair as potentiation.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                 function=None, history=8, window=None, nearest=False):
+        super().__init__(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency)
+
+        if history < 1:
+            raise ValueError("spike history must hold at least one spike")
+
+        if function is None:
+            function = Stdp.StdpFunction(0.0025, 0.015)
+
+        self.function = function
+        self.history = history
+        self.window = window
+        self.nearest = nearest
+
+        # spike times per neuron, -inf where there's no spike yet
+        self._pre_times = np.full((self.replicas, len(source), history), -np.inf)
+        self._pre_head = np.zeros((self.replicas, len(source)), dtype=np.int64)
+
+        self._post_times = np.full((self.replicas, len(target), history), -np.inf)
+        self._post_head = np.zeros((self.replicas, len(target)), dtype=np.int64)
+
+    def _record(self, times, heads, reps, neurons):
+        # a neuron can turn up more than once in a call (spikes handed over late), and each time gets a slot
+        key = reps * heads.shape[1] + neurons
+        order = np.argsort(key, kind="stable")
+
+        key = key[order]
+        reps = reps[order]
+        neurons = neurons[order]
+
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        rank = np.arange(len(key)) - np.repeat(starts, np.diff(np.r_[starts, len(key)]))
+
+        times[reps, neurons, (heads[reps, neurons] + rank) % self.history] = self._time
+
+        np.add.at(heads, (reps, neurons), 1)
+        heads %= self.history
+
+    def _window_sum(self, gaps, A, tau):
+        """A * exp(-gap / tau), summed over each row of gaps (or just the nearest spike)
+        """
+        if self.window is not None:
+            gaps = np.where(gaps <= self.window, gaps, np.inf)
+
+        if self.nearest:
+            return A * np.exp(-1.0 * gaps.min(axis=1) / tau)
+
+        return (A * np.exp(-1.0 * gaps / tau)).sum(axis=1)
+
+    def _same_tick_count(self, gaps):
+        """how many spikes in each row of gaps happened this tick (with nearest, at most one)
+        """
+        same = (gaps == 0.0).sum(axis=1)
+
+        if self.nearest:
+            return np.minimum(same, 1)
+
+        return same
+
+    def _pre_spikes(self, rows, reps, rep, syn):
+        f = self.function
+
+        # post before pre: depression
+        gaps = self._time - self._post_times[rep, self.indices[syn]]
+        change = -1.0 * self._window_sum(gaps, f.A_n, f.tau_n)
+
+        self._change_efficiency(rep, syn, change * self.max_efficiency[syn])
+
+        self._record(self._pre_times, self._pre_head, reps, rows)
+
+    def _post_spikes(self, cols, reps, rep, syn):
+        f = self.function
+
+        # pre before post: potentiation.  Source spikes are recorded first, so a same-tick pair shows up
+        # here, with a gap of 0, and counts as depression, as StdpFunction has it.
+        gaps = self._time - self._pre_times[rep, self._synapse_source[syn]]
+        same = self._same_tick_count(gaps)
+
+        change = self._window_sum(np.where(gaps > 0.0, gaps, np.inf), f.A_p, f.tau_p)
+        if self.nearest:
+            change = np.where(same > 0, 0.0, change)
+
+        change -= same * f.A_n
+
+        self._change_efficiency(rep, syn, change * self.max_efficiency[syn])
+
+        self._record(self._post_times, self._post_head, reps, cols)
+
+
+class DopamineStdpProjection(_TraceProjection):
+    """The array version of DopamineStdp.DopamineStdpSynapse, with the same default parameters.
+    STDP changes go to a per-synapse tag c, and efficiency moves by r * c * dt each step, where r is the
+    reward handed over by a DopamineStdp.RewardManager (add the projection with add_rewardable), plus the
+    value of reward_signal, a Neuromodulators.ModulatorSignal read by reference, if there is one.
+
+    More modulator channels (error, novelty, ...) can be subscribed to with subscribe: each channel's value,
+    times its tag_gain, is added to r, and times its weight_gain moves every weight by that much per second.
+    All channels are applied together, with one update of the tag and weight arrays per step.
+
+    With event_driven (connect with a reward manager), nothing is done per synapse per step: like the
+    event-driven object synapses, each synapse settles up the closed-form integral of r * c when it's
+    touched by a spike, when the manager's reward jumps, or when get_efficiencies is called.
+    Event-driven projections always use lazy traces, and can't have a reward_signal: only the manager's
+    reward has a closed form between settles.
+
+    Only synapses with an active tag (|c| > tag_epsilon) get reward, or decay c: the rest have c == 0,
+    and would just multiply by zero.  A tag that decays to tag_epsilon or below is zeroed and dropped
+    from the active set, until a spike tags it again.  With tag_epsilon=0 results are unchanged.
+    """
+
+    def __init__(self, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                 A_p=0.015, tau_p=0.0025, A_m=0.02, tau_m=0.0035, tau_c=15.0, lazy_traces=False, event_driven=False,
+                 tag_epsilon=0.0, reward_signal=None):
+        if event_driven and reward_signal is not None:
+            # settle only knows the reward manager's curve, not what a signal did between settles
+            raise ValueError("event-driven dopamine projections only take reward from their reward manager")
+
+        super().__init__(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                         A_p, tau_p, A_m, tau_m, lazy_traces or event_driven)
+
+        self.tau_c = tau_c
+
+        self.c = np.zeros((self.replicas, len(self.indices)))
+        self.r = np.zeros((self.replicas, 1))
+
+        self.event_driven = event_driven
+        self.reward_signal = reward_signal
+
+        # subscribed modulator channels, and their gains on r and on the weights
+        self.channels = []
+        self.tag_gain = np.zeros(0)
+        self.weight_gain = np.zeros(0)
+
+        # set by RewardManager.add_event_rewardable
+        self.reward_source = None
+        self._c_time = np.zeros_like(self.c)
+
+        # flat (replica * synapses + synapse) indices of the synapses with an active tag
+        self.tag_epsilon = tag_epsilon
+        self._active = np.zeros(0, dtype=np.int64)
+        self._is_active = np.zeros(self.c.shape, dtype=bool)
+
+        # an untagged synapse is never stepped, so clamp up front rather than on the first step
+        np.clip(self.efficiency, self.min_efficiency, self.max_efficiency, out=self.efficiency)
+
+    def _activate(self, rep, syn):
+        new = ~self._is_active[rep, syn]
+
+        if new.any():
+            rep = rep[new]
+            syn = syn[new]
+
+            self._is_active[rep, syn] = True
+
+            flat = np.unique(rep * len(self.indices) + syn)
+            self._active = np.concatenate([self._active, flat])
+
+    def _refresh_active(self):
+        """rebuild the active set from c, after c has been set from outside
+        """
+        self._is_active = np.abs(self.c) > self.tag_epsilon
+        self._active = np.flatnonzero(self._is_active)
+
+    def _active_synapses(self):
+        return np.divmod(self._active, len(self.indices))
+
+    def _drop_inactive(self, rep, syn, c):
+        """drop the synapses whose tags (c, the new values at rep, syn) have decayed away
+        """
+        keep = np.abs(c) > self.tag_epsilon
+
+        if not keep.all():
+            gone = ~keep
+
+            self.c[rep[gone], syn[gone]] = 0.0
+            self._is_active[rep[gone], syn[gone]] = False
+
+            self._active = self._active[keep]
+
+    def settle(self, now, rep=None, syn=None):
+        """event-driven mode: apply the weight change since each synapse (by default, every synapse)
+        was last settled, in one go
+        """
+        settle_all = rep is None
+        if settle_all:
+            # untagged synapses have nothing to settle
+            rep, syn = self._active_synapses()
+
+        rm = self.reward_source
+        k = 1.0 / rm.tau + 1.0 / self.tau_c
+
+        since = self._c_time[rep, syn]
+        gap = now - since
+        c = self.c[rep, syn]
+
+        # integral of (eql + (r0 - eql) * exp(-t / tau)) * c * exp(-t / tau_c) over the gap
+        decay = np.exp(-1.0 * gap / self.tau_c)
+        jump_time, jump_r = rm.last_jump()
+        r0 = rm.equilibrium + (jump_r - rm.equilibrium) * np.exp(-1.0 * (since - jump_time) / rm.tau)
+
+        change = rm.equilibrium * c * self.tau_c * (1.0 - decay)
+        change += (r0 - rm.equilibrium) * c * (1.0 - np.exp(-1.0 * k * gap)) / k
+
+        # frozen, the tags just decay
+        if not self.is_frozen():
+            lo = self.min_efficiency[syn]
+            hi = self.max_efficiency[syn]
+
+            self.efficiency[rep, syn] = np.clip(self.efficiency[rep, syn] + change, lo, hi)
+
+        self.c[rep, syn] = c * decay
+        self._c_time[rep, syn] = now
+
+        if settle_all:
+            self._drop_inactive(rep, syn, c * decay)
+
+    def settle_now(self):
+        """event-driven mode: settle every synapse up to now (PlasticitySwitch does, before freezing or thawing)
+        """
+        if self.event_driven:
+            self.settle(self._time)
+
+    def restructure(self, keep, *args, **kwargs):
+        if self.event_driven:
+            self.settle(self._time)
+
+        return super().restructure(keep, *args, **kwargs)
+
+    def _restructure(self, carry, moved, efficiency, delay, min_efficiency, max_efficiency):
+        super()._restructure(carry, moved, efficiency, delay, min_efficiency, max_efficiency)
+
+        self.c = carry(self.c, 0.0)
+        self._c_time = carry(self._c_time, self._time)
+        self._refresh_active()
+
+    def _on_pre(self, rep, syn, change):
+        if self.event_driven:
+            self.settle(self._time, rep, syn)
+
+        np.add.at(self.c, (rep, syn), change)
+
+        tagged = change != 0.0
+        self._activate(rep[tagged], syn[tagged])
+
+    _on_post = _on_pre
+
+    def _read_efficiency(self, rep, syn):
+        if self.event_driven:
+            self.settle(self._time, rep, syn)
+
+        return self.efficiency[rep, syn]
+
+    def get_efficiencies(self, replica=0):
+        if self.event_driven:
+            self.settle(self._time)
+
+        return super().get_efficiencies(replica)
+
+    def reward(self, r):
+        """accumulate a reward signal (one value, or one per replica), reset in step
+        """
+        self.r += np.reshape(r, (-1, 1))
+
+    def subscribe(self, signal, tag_gain=0.0, weight_gain=0.0):
+        """read a modulator channel (a Neuromodulators.ModulatorSignal) every step:
+        tag_gain scales its value into r, weight_gain into a drift applied to every weight
+        """
+        if self.event_driven and tag_gain != 0.0:
+            raise ValueError("event-driven dopamine projections only take tag reward from their reward manager")
+
+        self.channels.append(signal)
+        self.tag_gain = np.append(self.tag_gain, tag_gain)
+        self.weight_gain = np.append(self.weight_gain, weight_gain)
+
+    def _channel_values(self):
+        """channels x replicas: a signal's value may be one number, or one per replica
+        """
+        return np.array([np.broadcast_to(ch.value, (self.replicas,)) for ch in self.channels], dtype=float)
+
+    def _apply_held(self, steps, dt):
+        super()._apply_held(steps, dt)
+
+        # event-driven tags are settled by time anyway
+        if not self.event_driven and len(self._active):
+            rep, syn = self._active_synapses()
+
+            c = self.c[rep, syn] * (1.0 - dt / self.tau_c) ** steps
+            self.c[rep, syn] = c
+
+            self._drop_inactive(rep, syn, c)
+
+    def step(self, dt):
+        # frozen, reward is ignored and the decay is held (see _PlasticProjection)
+        frozen = self.is_frozen()
+
+        drift = None
+        if not frozen:
+            r = self.r[:, 0]
+            if self.reward_signal is not None:
+                r = r + self.reward_signal.value
+
+            if self.channels:
+                values = self._channel_values()
+
+                r = r + self.tag_gain @ values
+                drift = self.weight_gain @ values
+
+        if not frozen and not self.event_driven and len(self._active):
+            rep, syn = self._active_synapses()
+
+            c = self.c[rep, syn]
+
+            efficiency = self.efficiency[rep, syn] + r[rep] * c * dt
+            self.efficiency[rep, syn] = np.clip(efficiency, self.min_efficiency[syn], self.max_efficiency[syn])
+
+            c += -1.0 * c * (dt / self.tau_c)
+            self.c[rep, syn] = c
+
+            self._drop_inactive(rep, syn, c)
+
+        if drift is not None and drift.any():
+            if self.event_driven:
+                self.settle(self._time)
+
+            self.efficiency += drift[:, np.newaxis] * dt
+            np.clip(self.efficiency, self.min_efficiency, self.max_efficiency, out=self.efficiency)
+
+        self.r.fill(0.0)
+
+        self._decay_traces(dt)
+
+        super().step(dt)
+
+    @classmethod
+    def connect(cls, source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency,
+                reward_manager=None, **kwargs):
+        if kwargs.get("event_driven") and reward_manager is None:
+            raise ValueError("event-driven dopamine projections need a reward manager")
+
+        p = super().connect(source, target, indptr, indices, efficiency, delay, min_efficiency, max_efficiency, **kwargs)
+
+        if p.event_driven:
+            reward_manager.add_event_rewardable(p)
+        elif reward_manager is not None:
+            reward_manager.add_rewardable(p)
+
+        return p
@@ -0,0 +1,105 @@
+"""
+Reproducible random numbers, one independent stream per entity (and per replica).
+
+Every stochastic entity takes an rng: by default the global random module, so nothing changes for old
+scripts.  Hand each one its own stream instead, and what it draws no longer depends on what else is in the
+network, what order things are stepped or batched in, or which process runs it:
+
+    streams = RandomStreams.RandomStreams(seed=1234)
+
+    spiker = SnnBase.PoissonSpiker(0.5, 20.0, rng=streams.stream("input 3"))
+    pop = Populations.PoissonPopulation(0.5, freqs, replicas=4, rng=streams.generators("inputs", 4))
+
+Streams are NumPy Philox (counter-based) generators, keyed by (seed, key, replica) through a SeedSequence.
+Keys can be strings or non-negative ints; with no key, streams are numbered in the order they're asked for,
+which is reproducible as long as the network is built in the same order.
+"""
+
+import hashlib
+import itertools
+import math
+import random
+
+import numpy as np
+
+
+def _key_number(key):
+    if isinstance(key, str):
+        # hash() is salted per process, so it wouldn't be the same in a worker
+        return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+
+    key = int(key)
+    if key < 0:
+        raise ValueError("stream keys must be strings or non-negative ints")
+
+    return key
+
+def python_seeded_generators(replicas=1):
+    """one numpy Generator per replica, seeded from the random module, so random.seed() still makes runs
+    repeatable.  The default wherever no streams are given.
+    """
+    return [np.random.default_rng(random.getrandbits(64)) for _ in range(replicas)]
+
+
+class RandomStream:
+    """random-module-style draws (random, uniform, expovariate) for object entities, which take one number
+    at a time.  Numbers are fetched from the generator in blocks, and random is the __next__ of an iterator
+    over them, so a draw costs about what random.random does.
+    uniform with a size gives an array straight from the generator.
+    """
+
+    BLOCK = 64
+
+    def __init__(self, generator):
+        self.generator = generator
+
+        blocks = iter(lambda: generator.random(self.BLOCK).tolist(), None)
+        self.random = itertools.chain.from_iterable(blocks).__next__
+
+    def uniform(self, a, b, size=None):
+        if size is not None:
+            return self.generator.uniform(a, b, size)
+
+        return a + (b - a) * self.random()
+
+    def expovariate(self, lambd):
+        # the same transform the random module uses
+        return -1.0 * math.log(1.0 - self.random()) / lambd
+
+
+class RandomStreams:
+    def __init__(self, seed):
+        self.seed = seed
+
+        self._count = 0
+
+    def _auto_key(self):
+        # a string, so it can't run into anyone's int keys
+        key = "#{}".format(self._count)
+        self._count += 1
+
+        return key
+
+    def generator(self, key=None, replica=0):
+        """a numpy Generator for one entity (and replica), the same one every time for the same key
+        """
+        if key is None:
+            key = self._auto_key()
+
+        seq = np.random.SeedSequence(self.seed, spawn_key=(_key_number(key), replica))
+
+        return np.random.Generator(np.random.Philox(seq))
+
+    def generators(self, key=None, replicas=1):
+        """one generator per replica, for a population.  Replica r gets the same numbers however many
+        replicas there are.
+        """
+        if key is None:
+            key = self._auto_key()
+
+        return [self.generator(key, r) for r in range(replicas)]
+
+    def stream(self, key=None, replica=0):
+        """a RandomStream, for the object entities' rng
+        """
+        return RandomStream(self.generator(key, replica))
@@ -8,8 +8,13 @@ Created on Wed Mar 30 20:08:47 2016
 import SnnBase
 import Stdp
 import DopamineStdp
+import Populations
+import Projections
+import RandomStreams
 import random
 
+import numpy as np
+
 
 class Cluster:
     def __init__(self):
@@ -17,12 +22,39 @@ class Cluster:
         
     def add_neuron(self, neuron):
         self.neurons.append(neuron)
+
+    def get_entities(self):
+        return list(self.neurons)
+
+class PopulationCluster(Cluster):
+    """A cluster backed by an array population.
+    neurons holds one NeuronView per member, so the object connectors still work,
+    but only the population itself is handed to the simulation.
+    """
+    def __init__(self, population):
+        super().__init__()
+        self.population = population
+        self.neurons = [population[i] for i in range(len(population))]
+
+    def add_neuron(self, neuron):
+        raise SnnBase.SnnError("Cannot add neurons to a population-backed cluster")
+
+    def get_entities(self):
+        return [self.population]
             
-def create_pulsar_cluster(count, total_power, freq_min, freq_max):
+def create_pulsar_cluster(count, total_power, freq_min, freq_max, vectorized=False, replicas=1):
     if count < 1:
         raise ValueError("Pulsar count must be positive")
         
     freqs = SnnBase.linspace(freq_min, freq_max, count) # will throw if freqs are wrong
+
+    if vectorized:
+        per_pulse_power = [(total_power / count) / freq for freq in freqs]
+        pop = Populations.PulsarPopulation(per_pulse_power, freqs, replicas)
+        return PopulationCluster(pop)
+
+    if replicas != 1:
+        raise ValueError("Replicas need a vectorized cluster")
     
     c = Cluster()
     
@@ -35,7 +67,14 @@ def create_pulsar_cluster(count, total_power, freq_min, freq_max):
         
     return c
     
-def create_spiking_cluster(count, threshold, magnitude, leak_eql, leak_tau):
+def create_spiking_cluster(count, threshold, magnitude, leak_eql, leak_tau, vectorized=False, replicas=1):
+    if vectorized:
+        pop = Populations.LifPopulation(count, threshold, magnitude, leak_eql, leak_tau, replicas)
+        return PopulationCluster(pop)
+
+    if replicas != 1:
+        raise ValueError("Replicas need a vectorized cluster")
+
     c = Cluster()    
     
     for _ in range(count):
@@ -44,68 +83,131 @@ def create_spiking_cluster(count, threshold, magnitude, leak_eql, leak_tau):
         
     return c
     
-def create_poisson_cluster(count, total_power, freq_min, freq_max):
+def create_poisson_cluster(count, total_power, freq_min, freq_max, vectorized=False, replicas=1, streams=None):
+    """streams (a RandomStreams.RandomStreams) gives every spiker, or every replica, a stream of its own
+    """
     if count < 1:
         raise ValueError("Pulsar count must be positive")
         
     freqs = SnnBase.linspace(freq_min, freq_max, count)
     
+    if vectorized:
+        per_spike_power = [(total_power / count) / freq for freq in freqs]
+        rng = None if streams is None else streams.generators(replicas=replicas)
+        pop = Populations.PoissonPopulation(per_spike_power, freqs, replicas, rng)
+        return PopulationCluster(pop)
+
+    if replicas != 1:
+        raise ValueError("Replicas need a vectorized cluster")
+    
     c = Cluster()
     
     per_spiker_power = total_power / count # divide total power of spikers
     
     for freq in freqs:
         per_spike_power = per_spiker_power / freq # divide spiker power over pulses
-        p = SnnBase.PoissonSpiker(per_spike_power, freq)
+        p = SnnBase.PoissonSpiker(per_spike_power, freq, None if streams is None else streams.stream())
         c.add_neuron(p)
         
     return c
 
+# connectors draw initial efficiencies from rng: the random module by default, or a RandomStreams stream
+def _initial_efficiencies(rng, low, high, replicas, count):
+    if rng is random:
+        return np.array([g.uniform(low, high, count) for g in RandomStreams.python_seeded_generators(replicas)])
+
+    return rng.uniform(low, high, (replicas, count))
+
 class BasicSynapseConnector:
-    def __init__(self, delay, min_efficiency, max_efficiency):
+    def __init__(self, delay, min_efficiency, max_efficiency, rng=None):
         self.delay = delay
         self.min_efficiency = min_efficiency
         self.max_efficiency = max_efficiency
+        self.rng = random if rng is None else rng
     
     def connect(self, source, target):
-        e = random.uniform(self.min_efficiency, self.max_efficiency)
+        e = self.rng.uniform(self.min_efficiency, self.max_efficiency)
             
         syn = SnnBase.Synapse.connect(source=source, target=target, delay=self.delay, efficiency=e)
         
         return syn
 
+    def connect_populations(self, source, target):
+        """fully connect two array populations with a single sparse projection
+        """
+        indptr, indices = Projections.all_to_all(len(source), len(target))
+
+        e = _initial_efficiencies(self.rng, self.min_efficiency, self.max_efficiency, source.replicas, len(indices))
+
+        return Projections.SparseProjection.connect(source, target, indptr, indices, e, self.delay, self.min_efficiency, self.max_efficiency)
+
 class StdpSynapseConnector:
-    def __init__(self, delay, min_efficiency, max_efficiency):
+    def __init__(self, delay, min_efficiency, max_efficiency, clock=None, params=None, rng=None):
         self.delay = delay
         self.min_efficiency = min_efficiency
         self.max_efficiency = max_efficiency
+        self.clock = clock # a shared SnnBase.Clock makes the traces lazy
+        self.rng = random if rng is None else rng
+        
+        # every synapse made shares the one Stdp.StdpParameters
+        if params is None:
+            params = Stdp.DEFAULT_PARAMETERS
+        self.params = params.replace(delay=delay, min_efficiency=min_efficiency, max_efficiency=max_efficiency)
     
     def connect(self, source, target):
-        e = random.uniform(self.min_efficiency, self.max_efficiency)
+        e = self.rng.uniform(self.min_efficiency, self.max_efficiency)
         
-        syn = Stdp.StdpSynapse.connect(source=source, target=target, delay=self.delay, efficiency=e, min_efficiency=self.min_efficiency, max_efficiency=self.max_efficiency)
+        syn = Stdp.StdpSynapse.connect(source=source, target=target, delay=self.delay, efficiency=e, min_efficiency=self.min_efficiency, max_efficiency=self.max_efficiency, clock=self.clock, params=self.params)
         
         return syn
 
+    def connect_populations(self, source, target):
+        indptr, indices = Projections.all_to_all(len(source), len(target))
+
+        e = _initial_efficiencies(self.rng, self.min_efficiency, self.max_efficiency, source.replicas, len(indices))
+
+        p = self.params
+        return Projections.StdpProjection.connect(source, target, indptr, indices, e, self.delay, self.min_efficiency, self.max_efficiency,
+                                                  A_p=p.A_p, tau_p=p.tau_p, A_m=p.A_m, tau_m=p.tau_m, lazy_traces=self.clock is not None)
+
 class DopamineStdpSynapseConnector:
-    def __init__(self, delay, min_efficiency, max_efficiency, reward_manager):
+    def __init__(self, delay, min_efficiency, max_efficiency, reward_manager, clock=None, reward_signal=None, params=None, rng=None):
         self.delay = delay
         self.min_efficiency = min_efficiency
         self.max_efficiency = max_efficiency
         self.reward_manager = reward_manager
+        self.clock = clock
+        self.reward_signal = reward_signal
+        self.rng = random if rng is None else rng
+        
+        if params is None:
+            params = DopamineStdp.DEFAULT_PARAMETERS
+        self.params = params.replace(delay=delay, min_efficiency=min_efficiency, max_efficiency=max_efficiency)
     
     def connect(self, source, target):
-        e = random.uniform(self.min_efficiency, self.max_efficiency)
+        e = self.rng.uniform(self.min_efficiency, self.max_efficiency)
         
-        syn = DopamineStdp.DopamineStdpSynapse.connect(source=source, target=target, delay=self.delay, efficiency=e, min_efficiency=self.min_efficiency, max_efficiency=self.max_efficiency, reward_manager=self.reward_manager)
+        syn = DopamineStdp.DopamineStdpSynapse.connect(source=source, target=target, delay=self.delay, efficiency=e, min_efficiency=self.min_efficiency, max_efficiency=self.max_efficiency, reward_manager=self.reward_manager, clock=self.clock, reward_signal=self.reward_signal, params=self.params)
         
         return syn
+
+    def connect_populations(self, source, target):
+        indptr, indices = Projections.all_to_all(len(source), len(target))
+
+        e = _initial_efficiencies(self.rng, self.min_efficiency, self.max_efficiency, source.replicas, len(indices))
+
+        p = self.params
+        return Projections.DopamineStdpProjection.connect(source, target, indptr, indices, e, self.delay, self.min_efficiency, self.max_efficiency,
+                                                          reward_manager=self.reward_manager, A_p=p.A_p, tau_p=p.tau_p, A_m=p.A_m,
+                                                          tau_m=p.tau_m, tau_c=p.tau_c, lazy_traces=self.clock is not None,
+                                                          reward_signal=self.reward_signal)
         
 # NOTE: Network manages connection, but not state.  For now, just yield your entities and let something else run the sim
 class Network:
     def __init__(self):
         self.clusters = []
         self.synapses = []
+        self.projections = []
         
     def get_new_cluster(self):
         """add a new cluster and return it.
@@ -134,6 +236,14 @@ class Network:
         if len(target_cluster.neurons) < 1:
             raise ValueError("Target cluster is empty")
             
+        # population to population connections become one sparse projection, where the connector supports it
+        if isinstance(source_cluster, PopulationCluster) and isinstance(target_cluster, PopulationCluster) and hasattr(connector, "connect_populations"):
+            if source_cluster.population.replicas != target_cluster.population.replicas:
+                raise ValueError("source and target clusters have different replica counts")
+            proj = connector.connect_populations(source_cluster.population, target_cluster.population)
+            self.projections.append(proj)
+            return
+
         for source in source_cluster.neurons:
             for target in target_cluster.neurons:
                 syn = connector.connect(source, target)
@@ -143,9 +253,10 @@ class Network:
         entities = []
         
         for cluster in self.clusters:
-            entities += cluster.neurons
+            entities += cluster.get_entities()
             
         entities += self.synapses
+        entities += self.projections
         
         return entities
                             
@@ -1,5 +1,6 @@
 import math
 import random
+import weakref
 
 import SnnBase
 
@@ -24,42 +25,192 @@ class StdpFunction:
         else:
             return -1.0 * self.A_n * math.exp(gap / self.tau_n)
 
+class StdpParameters:
+    """An immutable set of plasticity parameters, shared by every synapse that uses the same values
+    (a whole connector's worth, usually) rather than copied into each one.
+    Get them with shared() or replace(), which hand back the one existing instance with those values.
+
+    The fraction (dt / tau) the traces (and the dopamine tag, tau_c) lose each step is worked out once per dt,
+    so stepping synapses doesn't divide.
+    """
+
+    _FIELDS = ("A_p", "tau_p", "A_m", "tau_m", "tau_c", "delay", "min_efficiency", "max_efficiency")
+
+    __slots__ = _FIELDS + ("_decay", "__weakref__")
+
+    _shared = weakref.WeakValueDictionary()
+
+    def __init__(self, A_p=0.015, tau_p=0.0025, A_m=0.015, tau_m=0.0025, tau_c=None, delay=0.0,
+                 min_efficiency=None, max_efficiency=None):
+        values = (A_p, tau_p, A_m, tau_m, tau_c, delay, min_efficiency, max_efficiency)
+        for name, value in zip(self._FIELDS, values):
+            object.__setattr__(self, name, value)
+
+        object.__setattr__(self, "_decay", {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("parameter sets are shared, use replace() to get one with different values")
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self._FIELDS)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __reduce__(self):
+        # unpickled sets are interned too (in a worker process, say)
+        return (_unpickle_parameters, (type(self), self._values()))
+
+    def __repr__(self):
+        return "StdpParameters({})".format(", ".join("{}={!r}".format(n, v) for n, v in zip(self._FIELDS, self._values())))
+
+    @classmethod
+    def shared(cls, **values):
+        params = cls(**values)
+        return cls._shared.setdefault(params, params)
+
+    def replace(self, **changes):
+        values = dict(zip(self._FIELDS, self._values()))
+        values.update(changes)
+
+        return self.shared(**values)
+
+    def decay(self, dt):
+        """(M, P, c) fractions lost in one forward Euler step of dt (dt / tau), c's None without a tau_c.
+        Apply as x += -1.0 * x * fraction, which is what the projections do.
+        """
+        fractions = self._decay.get(dt)
+
+        if fractions is None:
+            fractions = (dt / self.tau_m, dt / self.tau_p, None if self.tau_c is None else dt / self.tau_c)
+            self._decay[dt] = fractions
+
+        return fractions
+
+
+def _unpickle_parameters(cls, values):
+    return cls.shared(**dict(zip(cls._FIELDS, values)))
+
+
+def parameter(name):
+    """a synapse attribute that reads through to its shared parameter set;
+    setting it moves just that synapse to a set with the new value
+    """
+    def get(syn):
+        return getattr(syn.params, name)
+
+    def put(syn, value):
+        syn.params = syn.params.replace(**{name: value})
+
+    return property(get, put)
+
+DEFAULT_PARAMETERS = StdpParameters.shared()
+
 # TODO: finish updating this to work with Step/Exchange design
 #       add_spike and notify_of_spike should only occur during exchange step
 #       so they'll mark the total change and apply during compute
+# with a clock, the traces are lazy: rather than decaying every step, they keep the time they were last
+# brought up to date and decay exactly (exp(-gap / tau)) when a spike reads or bumps them.
+# NB: M and P are only up to date right after a spike, then.
+#
+# frozen (or a frozen Neuromodulators.PlasticitySwitch) turns learning off: spikes are passed on with a
+# fixed efficiency and the traces aren't bumped.  Stepped traces aren't decayed while frozen either: the frozen
+# steps are counted and the decay made up in one go when it's thawed (lazy traces catch up by the clock anyway)
+#
+# the constants (A_p, tau_p, A_m, tau_m, delay and the bounds) live in params, a shared StdpParameters;
+# pass one in to set the A's and taus, the delay and bounds given here override its own
 class StdpSynapse:
-    def __init__(self, delay, efficiency, min_efficiency, max_efficiency):
-        self.delay = delay
-        self.min_efficiency = min_efficiency
-        self.max_efficiency = max_efficiency
+    # no per-instance __dict__: with the constants in params, this is all a synapse holds
+    __slots__ = ("params", "efficiency", "M", "P", "_line", "targets", "efficiency_update", "clock", "_trace_time",
+                 "frozen", "plasticity_switch", "_held")
+
+    def __init__(self, delay, efficiency, min_efficiency, max_efficiency, clock=None, params=None):
+        if params is None:
+            params = DEFAULT_PARAMETERS
+            
+        self.params = params.replace(delay=delay, min_efficiency=min_efficiency, max_efficiency=max_efficiency)
         
         self.efficiency = efficiency
         
         self.M = 0.0
-        self.A_m = 0.015
-        self.tau_m = 0.0025
-        
         self.P = 0.0
-        self.A_p = 0.015
-        self.tau_p = 0.0025
         
-        self.waiting_spikes = []
-        self.outgoing_spikes = []
+        self._line = SnnBase.DelayLine()
         
         self.targets = []
         
         self.efficiency_update = 0.0        
         
+        self.clock = clock
+        self._trace_time = 0.0
+        
+        self.frozen = False
+        self.plasticity_switch = None
+        
+        # [steps, dt] of decay owed since it was frozen, or None
+        self._held = None
+        
+    A_p = parameter("A_p")
+    tau_p = parameter("tau_p")
+    A_m = parameter("A_m")
+    tau_m = parameter("tau_m")
+    delay = parameter("delay")
+    min_efficiency = parameter("min_efficiency")
+    max_efficiency = parameter("max_efficiency")
+        
+    def is_frozen(self):
+        return self.frozen or (self.plasticity_switch is not None and self.plasticity_switch.frozen)
+        
+    def _hold(self, dt):
+        if self._held is None:
+            self._held = [0, dt]
+        elif self._held[1] != dt:
+            self._thaw()
+            self._held = [0, dt]
+            
+        self._held[0] += 1
+        
+    def _thaw(self):
+        # apply the decay held while frozen
+        steps, dt = self._held
+        self._held = None
+        
+        if self.clock is None:
+            decay_M, decay_P, _ = self.params.decay(dt)
+            self.M *= (1.0 - decay_M) ** steps
+            self.P *= (1.0 - decay_P) ** steps
+        
+    def _catch_up(self):
+        gap = self.clock.time - self._trace_time
+        
+        if gap > 0.0:
+            p = self.params
+            self.M *= math.exp(-1.0 * gap / p.tau_m)
+            self.P *= math.exp(-1.0 * gap / p.tau_p)
+            
+            self._trace_time = self.clock.time
+        
     def add_spike(self, magnitude):
+        if self.is_frozen():
+            self._line.add(magnitude)
+            return
+            
+        if self._held is not None:
+            self._thaw()
+            
+        if self.clock is not None:
+            self._catch_up()
+            
         # every time we receive a spike, add A+ to P
-        self.P += self.A_p
+        self.P += self.params.A_p
 
         # then (?) schedule a decrement by M*g_max (M should be negative or 0)        
-        self.efficiency_update += self.M * self.max_efficiency
+        self.efficiency_update += self.M * self.params.max_efficiency
             
-        ds = SnnBase.DelayedSpike(self.delay, magnitude) # TODO: inter-module coupling for trivial class
-        
-        self.waiting_spikes.append(ds)
+        self._line.add(magnitude)
     
     def add_target(self, target):
         self.targets.append(target)
@@ -68,10 +219,19 @@ class StdpSynapse:
         return self.efficiency
         
     def notify_of_spike(self):
+        if self.is_frozen():
+            return
+            
+        if self._held is not None:
+            self._thaw()
+            
+        if self.clock is not None:
+            self._catch_up()
+            
         # every time the post-synaptic fires, subtract A- from M
-        self.M -= self.A_m
+        self.M -= self.params.A_m
         
-        self.efficiency_update += self.P * self.max_efficiency
+        self.efficiency_update += self.P * self.params.max_efficiency
         
     def prepare(self):
         # apply efficiency change from last cycle before step / exchange
@@ -79,42 +239,60 @@ class StdpSynapse:
             self.efficiency += self.efficiency_update
             
             # clip to allowed range
-            if self.efficiency > self.max_efficiency:
-                self.efficiency = self.max_efficiency
-            elif self.efficiency < self.min_efficiency:
-                self.efficiency = self.min_efficiency
+            p = self.params
+            if self.efficiency > p.max_efficiency:
+                self.efficiency = p.max_efficiency
+            elif self.efficiency < p.min_efficiency:
+                self.efficiency = p.min_efficiency
                 
             self.efficiency_update = 0.0
             
     def step(self, dt):        
-        # M and P exponentially decay to 0
-        delta_M = -1.0 * self.M * (dt / self.tau_m)
-        self.M += delta_M
-        
-        delta_P = -1.0 * self.P * (dt / self.tau_p)
-        self.P += delta_P
+        if self.is_frozen():
+            self._hold(dt)
+        else:
+            if self._held is not None:
+                self._thaw()
+                
+            # M and P exponentially decay to 0
+            if self.clock is None:
+                decay_M, decay_P, _ = self.params.decay(dt)
+                self.M += -1.0 * self.M * decay_M
+                self.P += -1.0 * self.P * decay_P
         
         # spike, as basic delayed neuron
-        temp_spikes = self.waiting_spikes
-        self.waiting_spikes = []
-        self.outgoing_spikes = []
+        self._line.step(dt, self.params.delay)
 
-        for spike in temp_spikes:
-            spike.remaining_delay -= dt
-            
-            if spike.remaining_delay <= 0.0:
-                self.outgoing_spikes.append(spike)
-            else:
-                self.waiting_spikes.append(spike)
+    @classmethod
+    def batch_step(cls, synapses, dt):
+        last = None
+        for s in synapses:
+            if s.is_frozen():
+                s._hold(dt)
+                continue
+                
+            if s._held is not None:
+                s._thaw()
+                
+            if s.clock is None:
+                if s.params is not last:
+                    last = s.params
+                    decay_M, decay_P, _ = last.decay(dt)
+
+                s.M += -1.0 * s.M * decay_M
+                s.P += -1.0 * s.P * decay_P
+
+        SnnBase.step_delay_lines(synapses, dt, [s.params.delay for s in synapses])
                 
     def exchange(self):
-        for s in self.outgoing_spikes:
+        if self._line.outgoing_count:
+            m = self.efficiency * self._line.outgoing
             for t in self.targets:
-                t.add_spike(self.efficiency * s.magnitude)
+                t.add_spike(m)
                 
     @staticmethod
-    def connect(source, target, delay, efficiency, min_efficiency, max_efficiency):
-        s = StdpSynapse(delay, efficiency, min_efficiency, max_efficiency)
+    def connect(source, target, delay, efficiency, min_efficiency, max_efficiency, clock=None, params=None):
+        s = StdpSynapse(delay, efficiency, min_efficiency, max_efficiency, clock, params)
         
         s.add_target(target)
         source.add_synapse(s)
@@ -0,0 +1,134 @@
+"""
+Structural plasticity for projections: synapses that sit at their lower bound for long enough are removed,
+and (optionally) as many new ones are grown between random pairs of neurons that aren't connected yet.
+
+    pruner = Structural.Pruner(period=1.0, prune_after=100.0, regrow=True)
+    pruner.add_projection(proj)
+    sim.add_entity(pruner)
+
+Pruned projections are compacted (see Projections.SparseProjection.restructure), so a long run gets cheaper
+as its weights settle, rather than carrying dead synapses around.  Topology is shared by every replica, so a
+synapse is only at its bound when it's there in every replica.
+"""
+
+import numpy as np
+
+import Projections
+import RandomStreams
+
+
+class Pruner:
+    """Checks its projections every period seconds.  A synapse within tolerance of its min_efficiency
+    counts as pinned there; one that has been pinned (as far as the checks can tell) for prune_after
+    seconds is removed.  With regrow, each removed synapse is replaced by one between a new random pair,
+    with the same delay and bounds, and an efficiency of regrow_efficiency (by default halfway between them).
+    """
+
+    def __init__(self, period, prune_after, regrow=False, regrow_efficiency=None, tolerance=0.0, rng=None):
+        if period <= 0.0:
+            raise ValueError("pruning period must be positive")
+
+        self.period = period
+        self.prune_after = prune_after
+        self.regrow = regrow
+        self.regrow_efficiency = regrow_efficiency
+        self.tolerance = tolerance
+
+        if rng is None:
+            rng, = RandomStreams.python_seeded_generators()
+        self.rng = rng
+
+        self.time = 0.0
+        self._wait = period
+        self._due = False
+
+        self.projections = []
+
+        # per projection, when each synapse was first seen at its bound (nan if it isn't)
+        self._floor_since = []
+
+        self.pruned = 0
+        self.grown = 0
+
+    def add_projection(self, projection):
+        self.projections.append(projection)
+        self._floor_since.append(np.full(len(projection), np.nan))
+
+    def prepare(self):
+        # pruning between ticks, so no projection has a delivery half done
+        if self._due:
+            self._due = False
+
+            for i in range(len(self.projections)):
+                self._prune(i)
+
+    def step(self, dt):
+        self.time += dt
+        self._wait -= dt
+
+        if self._wait <= 0.0:
+            self._wait = self.period
+            self._due = True
+
+    def _prune(self, i):
+        proj = self.projections[i]
+        since = self._floor_since[i]
+
+        efficiency = np.array([proj.get_efficiencies(r) for r in range(proj.replicas)])
+        pinned = np.all(efficiency <= proj.min_efficiency + self.tolerance, axis=0)
+
+        since[~pinned] = np.nan
+        since[pinned & np.isnan(since)] = self.time
+
+        doomed = pinned & (self.time - since >= self.prune_after)
+        if not doomed.any():
+            return
+
+        sources = targets = ()
+        efficiency = delay = 0.0
+        min_efficiency = max_efficiency = None
+
+        if self.regrow:
+            pairs = self._free_pairs(proj, ~doomed, int(doomed.sum()))
+
+            sources, targets = np.divmod(pairs, len(proj.target))
+
+            delay = proj.delay[doomed][:len(pairs)]
+            min_efficiency = proj.min_efficiency[doomed][:len(pairs)]
+            max_efficiency = proj.max_efficiency[doomed][:len(pairs)]
+
+            if self.regrow_efficiency is None:
+                efficiency = 0.5 * (min_efficiency + max_efficiency)
+            else:
+                efficiency = self.regrow_efficiency
+
+        moved = proj.restructure(~doomed, sources, targets, efficiency, delay, min_efficiency, max_efficiency)
+
+        carried = np.full(len(proj), np.nan)
+        carried[moved[moved >= 0]] = since[moved >= 0]
+        self._floor_since[i] = carried
+
+        self.pruned += int(doomed.sum())
+        self.grown += len(sources)
+
+    def _free_pairs(self, proj, keep, n):
+        """up to n random (source * target count + target) pairs, not connected by the synapses being kept.
+        The pairs being pruned are free, so a full projection can still regrow.
+        """
+        count = len(proj.source) * len(proj.target)
+
+        taken = set((proj.synapse_sources()[keep] * len(proj.target) + proj.indices[keep]).tolist())
+
+        n = min(n, count - len(taken))
+
+        pairs = []
+        while len(pairs) < n:
+            for k in self.rng.integers(0, count, 2 * (n - len(pairs))).tolist():
+                if k not in taken:
+                    taken.add(k)
+                    pairs.append(k)
+
+                    if len(pairs) == n:
+                        break
+
+        return np.array(pairs, dtype=np.int64)
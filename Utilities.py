@@ -77,11 +77,13 @@ class ToggleRandomPulsar:
     - quiet (no firing)
     """
     
-    def __init__(self, magnitude, frequency):
+    def __init__(self, magnitude, frequency, rng=None):
         self.magnitude = magnitude
         self.frequency = frequency # not used after construction at present
         self.prob = 1.0 / frequency
 
+        self.rng = random if rng is None else rng # see RandomStreams
+
         self.synapses = []
         
         self.spike_listeners = []
@@ -101,7 +103,7 @@ class ToggleRandomPulsar:
             self._active = False
 
         if self._active:
-            if random.random() < self.prob * dt:
+            if self.rng.random() < self.prob * dt:
                 self._spike = True
             
     def exchange(self):
@@ -136,13 +138,15 @@ class VariableStochasticPulsar:
     """A pulsar that fires randomly, but can be switched between two firing rates.
     """
     
-    def __init__(self, magnitude, low_frequency, high_frequency):
+    def __init__(self, magnitude, low_frequency, high_frequency, rng=None):
         self.magnitude = magnitude
         self.high_frequency = high_frequency # not used after construction at present
         self.low_frequency = low_frequency
         #self._prob = 1.0 / low_frequency
         self._prob = low_frequency
 
+        self.rng = random if rng is None else rng
+
         self.synapses = []
         
         self.spike_listeners = []
@@ -150,7 +154,7 @@ class VariableStochasticPulsar:
         self._spike = False
 
     def step(self, dt):
-        if random.random() < self._prob * dt:
+        if self.rng.random() < self._prob * dt:
             self._spike = True
             
     def exchange(self):
@@ -0,0 +1,68 @@
+"""
+Checks that a parallel run gives the same results as a serial one.  Run with python -m pytest.
+"""
+
+import numpy as np
+import pytest
+
+import SnnBase
+import DopamineStdp
+import SpikingNetwork
+import RandomStreams
+import ParallelSnn
+
+
+class Rewarder:
+    """adds a reward every so many ticks, whatever the network does
+    """
+
+    def __init__(self, manager, every):
+        self.manager = manager
+        self.every = every
+        self.ticks = 0
+
+    def step(self, dt):
+        self.ticks += 1
+
+        if self.ticks % self.every == 0:
+            self.manager.add_reward(1.0)
+
+
+def _rewarded_network():
+    streams = RandomStreams.RandomStreams(11)
+
+    manager = DopamineStdp.RewardManager(0.0, 0.2)
+
+    network = SpikingNetwork.Network()
+    inputs = SpikingNetwork.create_poisson_cluster(20, 800.0, 5.0, 60.0, vectorized=True, streams=streams)
+    neurons = SpikingNetwork.create_spiking_cluster(20, 1.0, 1.0, 0.0, 0.05, vectorized=True)
+    network.add_cluster(inputs)
+    network.add_cluster(neurons)
+
+    connector = SpikingNetwork.DopamineStdpSynapseConnector(0.002, 0.0, 1.0, manager, rng=streams.stream("weights"))
+    network.connect_clusters(inputs, neurons, connector)
+
+    return network, [manager, Rewarder(manager, 300)]
+
+def test_rewarded_dopamine_projection_matches_serial():
+    network, rewarding = _rewarded_network()
+    initial = network.projections[0].get_efficiencies()
+    SnnBase.Simulation(0.001, network.get_entities() + rewarding).run_until(2.0)
+    serial = network.projections[0].get_efficiencies()
+
+    # the reward has to have done something, for the comparison to mean anything
+    assert np.abs(serial - initial).max() > 0.01
+
+    network, rewarding = _rewarded_network()
+    sim = ParallelSnn.ParallelSimulation(0.001, network, workers=2, partition=[0, 1], global_entities=rewarding)
+    sim.run_until(2.0)
+    parallel = network.projections[0].get_efficiencies()
+
+    assert np.array_equal(serial, parallel)
+    assert rewarding[0].time == pytest.approx(2.0)
+
+def test_unrewarded_dopamine_projection_is_refused():
+    network, _ = _rewarded_network()
+
+    with pytest.raises(SnnBase.SnnError):
+        ParallelSnn.ParallelSimulation(0.001, network, workers=2, partition=[0, 1])
@@ -0,0 +1,42 @@
+"""
+Checks for the plastic projections.  Run with python -m pytest.
+"""
+
+import numpy as np
+
+import SnnBase
+import DopamineStdp
+import Populations
+import Projections
+import Neuromodulators
+
+
+def test_frozen_event_driven_projection_keeps_its_weights():
+    source = Populations.PulsarPopulation(0.6, [90.0, 130.0, 170.0])
+    target = Populations.LifPopulation(2, 1.0, 1.0, 0.0, 0.05)
+
+    rm = DopamineStdp.RewardManager(0.1, 0.2)
+    switch = Neuromodulators.PlasticitySwitch()
+
+    indptr, indices = Projections.all_to_all(3, 2)
+    proj = Projections.DopamineStdpProjection.connect(source, target, indptr, indices, 0.5, 0.004, 0.0, 1.0,
+                                                      reward_manager=rm, event_driven=True)
+    switch.add(proj)
+
+    class Rewarder:
+        def step(self, dt):
+            rm.add_reward(1.0)
+
+    sim = SnnBase.Simulation(1.0 / 1000.0, [source, target, proj, rm])
+
+    # learn for a while, so there are tags to be rewarded
+    sim.run_until(0.5)
+    assert np.abs(proj.c).max() > 0.0
+
+    switch.freeze()
+    before = proj.get_efficiencies().copy()
+
+    sim.add_entity(Rewarder())
+    sim.run_until(1.0)
+
+    assert np.array_equal(proj.get_efficiencies(), before)